@@ -1,11 +1,142 @@
+import functools
 import hashlib
+import os
+import re
 import secrets
+import sys
+import threading
 import time
-from typing import Dict, Optional, Tuple
-from dataclasses import dataclass, asdict
+from collections import OrderedDict, defaultdict, deque
+from typing import Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass
 from datetime import datetime
 
-@dataclass
+# hashlib usa EVP_sha256 de OpenSSL, que ya despacha a SHA-NI / ARMv8 SHA2
+# cuando la CPU lo soporta; enlazamos el constructor una sola vez
+_sha256 = hashlib.sha256
+
+# 0x + exactamente 40 caracteres hexadecimales
+_ETH_ADDRESS_RE = re.compile(r"0x[0-9a-fA-F]{40}")
+
+# Hash de transacción tal y como lo genera _sha256_hex: 0x + 64 hex en minúsculas
+_TX_HASH_RE = re.compile(r"0x[0-9a-f]{64}")
+
+def _sha256_hex(data: bytes) -> str:
+    """SHA-256 en hexadecimal con prefijo 0x"""
+    # hexdigest() formatea en C; es más rápido que digest().hex()
+    return "0x" + _sha256(data).hexdigest()
+
+class SaltPool:
+    """
+    Pool de salts aleatorios leídos de os.urandom en bloques grandes
+    
+    Una sola lectura de `chunk_size` bytes sirve para muchos salts; cada salt
+    se entrega una única vez y se codifica a hex al sacarlo.
+    """
+    
+    def __init__(self, salt_bytes: int = 32, chunk_size: int = 64 * 1024):
+        self.salt_bytes = salt_bytes
+        self.chunk_size = chunk_size
+        self._salts: deque = deque()
+        self._lock = threading.Lock()
+    
+    def _refill(self) -> None:
+        chunk = os.urandom(self.chunk_size)
+        n = self.salt_bytes
+        self._salts.extend(chunk[i:i + n] for i in range(0, len(chunk) - n + 1, n))
+    
+    def clear(self) -> None:
+        """Descarta los salts precalculados"""
+        self._salts.clear()
+    
+    def pop(self) -> str:
+        """Devuelve un salt nuevo en hexadecimal"""
+        while True:
+            try:
+                return self._salts.popleft().hex()
+            except IndexError:
+                with self._lock:
+                    if not self._salts:
+                        self._refill()
+
+_salt_pool = SaltPool()
+# Un proceso hijo no debe reutilizar los salts ya leídos por el padre
+os.register_at_fork(after_in_child=_salt_pool.clear)
+
+def intern_address(address: str) -> str:
+    """
+    Interna una dirección ya normalizada (minúsculas)
+    
+    Las contrapartes repetidas comparten una sola cadena en memoria y la
+    comparación se resuelve por identidad. sys.intern libera la cadena
+    cuando deja de usarse, así que el pool no crece sin límite.
+    """
+    assert address == address.lower(), "address must be lowercase"
+    return sys.intern(address)
+
+def _build_payload(
+    sender: str,
+    recipient: str,
+    amount: float,
+    token: str,
+    salt: str,
+    timestamp: int
+) -> bytes:
+    """
+    Construye el payload a hashear a partir de datos ya normalizados
+    (direcciones en minúsculas, token en mayúsculas)
+    
+    Formato: sender:recipient:amount:token:salt:timestamp
+    """
+    # Unir como str y codificar una sola vez: las direcciones y el salt son
+    # ASCII compacto, así que encode() es una única copia del buffer
+    return ":".join((
+        sender,
+        recipient,
+        str(amount),
+        token,
+        salt,
+        str(timestamp)
+    )).encode()
+
+def batch_verify(items: List[Tuple[bytes, str]]) -> List[bool]:
+    """
+    Verifica en lote pares (payload, hash esperado)
+    
+    Args:
+        items: Lista de tuplas (payload en bytes, hash esperado con prefijo 0x)
+        
+    Returns:
+        Lista de booleanos en el mismo orden que la entrada
+    """
+    # Comparar digests en bytes evita formatear hex por cada elemento. Solo se
+    # aceptan hashes en la forma canónica (0x + 64 hex en minúsculas), igual
+    # que la comparación exacta de verify_transaction_data
+    sha = _sha256
+    match = _TX_HASH_RE.fullmatch
+    results = []
+    for payload, expected_hash in items:
+        if not match(expected_hash):
+            results.append(False)
+            continue
+        results.append(sha(payload).digest() == bytes.fromhex(expected_hash[2:]))
+    return results
+
+@functools.lru_cache(maxsize=8192, typed=True)
+def _transaction_digest(
+    sender: str,
+    recipient: str,
+    amount: float,
+    token: str,
+    salt: str,
+    timestamp: int
+) -> str:
+    """Hash 0x... de los datos normalizados de una transacción (memoizado)"""
+    # typed=True: 1 y 1.0 son la misma clave para lru_cache, pero str(amount)
+    # produce payloads distintos
+    return _sha256_hex(_build_payload(sender, recipient, amount, token, salt, timestamp))
+
+@dataclass(slots=True)
 class HiddenTransaction:
     """Representa una transacción oculta con toda su metadata"""
     sender: str
@@ -17,12 +148,126 @@ class HiddenTransaction:
     hash: str
     status: str = "pending"  # pending, claimed, cancelled
 
+def _transaction_details(tx: HiddenTransaction) -> Dict:
+    """Vista dict de una transacción, construida una sola vez"""
+    return {
+        "sender": tx.sender,
+        "recipient": tx.recipient,
+        "amount": tx.amount,
+        "token": tx.token,
+        "salt": tx.salt,
+        "timestamp": tx.timestamp,
+        "hash": tx.hash,
+        "status": tx.status
+    }
+
+# Número de segmentos de la caché de pendientes
+CACHE_SHARDS = 16
+
+class _CacheShard:
+    """
+    Segmento de la caché LRU de transacciones pendientes
+    
+    Agrupa las transacciones, el índice por destinatario y las verificaciones
+    cacheadas de un subconjunto de hashes. Las escrituras toman el lock del
+    segmento; las lecturas de dict no lo necesitan.
+    """
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        # hash -> (transacción, vista dict precalculada para lecturas)
+        self.transactions: "OrderedDict[str, Tuple[HiddenTransaction, Dict]]" = OrderedDict()
+        # destinatario -> hashes pendientes de este segmento
+        self.by_recipient: Dict[str, Set[str]] = defaultdict(set)
+        # Pares (hash, destinatario) ya verificados
+        self.verified: Set[Tuple[str, str]] = set()
+    
+    def get(self, transaction_hash: str) -> Optional[Tuple[HiddenTransaction, Dict]]:
+        entry = self.transactions.get(transaction_hash)
+        if entry is not None:
+            try:
+                self.transactions.move_to_end(transaction_hash)
+            except KeyError:
+                pass  # Desalojada entre la lectura y el reordenado
+        return entry
+    
+    def put(self, tx: HiddenTransaction) -> None:
+        entry = (tx, _transaction_details(tx))
+        with self.lock:
+            self.transactions[tx.hash] = entry
+            self.by_recipient[tx.recipient].add(tx.hash)
+            while len(self.transactions) > self.capacity:
+                self._evict_locked(next(iter(self.transactions)))
+    
+    def mark_verified(self, key: Tuple[str, str]) -> None:
+        with self.lock:
+            # Solo mientras la transacción siga en caché
+            if key[0] in self.transactions:
+                self.verified.add(key)
+    
+    def evict(self, transaction_hash: str) -> None:
+        with self.lock:
+            self._evict_locked(transaction_hash)
+    
+    def _evict_locked(self, transaction_hash: str) -> None:
+        entry = self.transactions.pop(transaction_hash, None)
+        if entry is None:
+            return
+        tx = entry[0]
+        self.verified.discard((transaction_hash, tx.recipient))
+        recipient_hashes = self.by_recipient.get(tx.recipient)
+        if recipient_hashes is not None:
+            recipient_hashes.discard(transaction_hash)
+            if not recipient_hashes:
+                del self.by_recipient[tx.recipient]
+
 class PrivacyEngine:
-    """Motor principal para generación y validación de transacciones invisibles"""
+    """
+    Motor principal para generación y validación de transacciones invisibles
+    
+    La base de datos es la fuente de verdad; el motor solo mantiene una caché
+    LRU acotada de transacciones pendientes. El motor no accede a la BD: quien
+    llama carga las que falten con cache_transaction() (ver is_cached()).
+    
+    Las direcciones deben llegar normalizadas en minúsculas y los tokens en
+    mayúsculas; la normalización se hace una sola vez en la capa de la API.
+    """
+    
+    def __init__(self, cache_size: int = 4096, num_shards: int = CACHE_SHARDS):
+        self.cache_size = cache_size
+        # Caché segmentada por hash; cada segmento es un LRU con su propio lock
+        shard_capacity = max(1, cache_size // num_shards)
+        self._shards = [_CacheShard(shard_capacity) for _ in range(num_shards)]
+    
+    def _shard(self, transaction_hash: str) -> _CacheShard:
+        # hash() de str es estable dentro del proceso y no falla con hashes malformados
+        return self._shards[hash(transaction_hash) % len(self._shards)]
+    
+    def _cache_put(self, tx: HiddenTransaction) -> None:
+        """Inserta una transacción pendiente en su segmento de la caché"""
+        self._shard(tx.hash).put(tx)
+    
+    def _lookup(self, transaction_hash: str) -> Optional[Tuple[HiddenTransaction, Dict]]:
+        """Busca en la caché, marcando la entrada como usada recientemente"""
+        return self._shard(transaction_hash).get(transaction_hash)
     
-    def __init__(self):
-        self.pending_transactions: Dict[str, HiddenTransaction] = {}
-        self.claimed_transactions: Dict[str, HiddenTransaction] = {}
+    def is_cached(self, transaction_hash: str) -> bool:
+        """Indica si la transacción está en la caché de pendientes"""
+        return transaction_hash in self._shard(transaction_hash).transactions
+    
+    def cache_transaction(self, tx: HiddenTransaction) -> None:
+        """
+        Añade a la caché una transacción cargada de la fuente de verdad
+        
+        Solo se cachean transacciones pendientes
+        """
+        if tx.status != "pending":
+            return
+        tx.sender = intern_address(tx.sender)
+        tx.recipient = intern_address(tx.recipient)
+        tx.token = sys.intern(tx.token)
+        self._cache_put(tx)
     
     def generate_hidden_transaction(
         self, 
@@ -43,42 +288,44 @@ class PrivacyEngine:
         Returns:
             Dict con hash, salt, timestamp y otros datos
         """
+        # Cadenas internadas (ya normalizadas por quien llama)
+        assert token == token.upper(), "token must be uppercase"
+        sender = intern_address(sender)
+        recipient = intern_address(recipient)
+        token = sys.intern(token)
+        
         # Generar salt criptográficamente seguro
-        salt = secrets.token_hex(32)  # 64 caracteres hex
+        salt = _salt_pool.pop()  # 64 caracteres hex
         timestamp = int(time.time())
         
         # Crear payload para hash
-        # Formato: sender:recipient:amount:token:salt:timestamp
-        payload = f"{sender.lower()}:{recipient.lower()}:{amount}:{token.upper()}:{salt}:{timestamp}"
+        payload = _build_payload(sender, recipient, amount, token, salt, timestamp)
         
-        # Generar hash SHA-256
-        transaction_hash = hashlib.sha256(payload.encode()).hexdigest()
-        
-        # Convertir a formato 0x para compatibilidad con blockchain
-        transaction_hash_hex = f"0x{transaction_hash}"
+        # Generar hash SHA-256 en formato 0x para compatibilidad con blockchain
+        transaction_hash_hex = _sha256_hex(payload)
         
         # Crear objeto de transacción oculta
         hidden_tx = HiddenTransaction(
-            sender=sender.lower(),
-            recipient=recipient.lower(),
+            sender=sender,
+            recipient=recipient,
             amount=amount,
-            token=token.upper(),
+            token=token,
             salt=salt,
             timestamp=timestamp,
             hash=transaction_hash_hex,
             status="pending"
         )
         
-        # Almacenar en pendientes
-        self.pending_transactions[transaction_hash_hex] = hidden_tx
+        # Almacenar en la caché de pendientes (la persistencia la hace quien llama)
+        self._cache_put(hidden_tx)
         
         return {
             "hash": transaction_hash_hex,
             "salt": salt,
             "timestamp": timestamp,
-            "sender": sender.lower(),
+            "sender": sender,
             "amount": amount,
-            "token": token.upper(),
+            "token": token,
             "status": "pending"
         }
     
@@ -93,14 +340,24 @@ class PrivacyEngine:
         Returns:
             True si el hash pertenece al destinatario
         """
-        if transaction_hash not in self.pending_transactions:
-            # Verificar también en reclamadas
-            if transaction_hash in self.claimed_transactions:
-                return False  # Ya fue reclamada
+        recipient = intern_address(recipient)
+        shard = self._shard(transaction_hash)
+        key = (transaction_hash, recipient)
+        if key in shard.verified:
+            return True
+        
+        entry = shard.get(transaction_hash)
+        if entry is None:
             return False
         
-        tx = self.pending_transactions[transaction_hash]
-        return tx.recipient.lower() == recipient.lower()
+        tx = entry[0]
+        if tx.status != "pending":
+            return False  # Ya fue reclamada
+        if tx.recipient != recipient:
+            return False
+        
+        shard.mark_verified(key)
+        return True
     
     def verify_transaction_data(
         self,
@@ -115,17 +372,39 @@ class PrivacyEngine:
         """
         Verifica que un hash corresponde exactamente a los datos proporcionados
         """
-        # Recrear payload
-        payload = f"{sender.lower()}:{recipient.lower()}:{amount}:{token.upper()}:{salt}:{timestamp}"
-        
-        # Generar hash
-        computed_hash = f"0x{hashlib.sha256(payload.encode()).hexdigest()}"
+        # Recrear payload y hash (memoizado para verificaciones repetidas)
+        computed_hash = _transaction_digest(sender, recipient, amount, token, salt, timestamp)
         
         return computed_hash == transaction_hash
     
+    def verify_transactions_batch(self, transactions: List[Dict]) -> List[bool]:
+        """
+        Verifica en lote que varios hashes corresponden a sus datos
+        
+        Args:
+            transactions: Lista de dicts con hash, sender, recipient, amount,
+                token, salt y timestamp
+            
+        Returns:
+            Lista de booleanos en el mismo orden que la entrada
+        """
+        items = [
+            (
+                _build_payload(
+                    tx["sender"], tx["recipient"], tx["amount"],
+                    tx["token"], tx["salt"], tx["timestamp"]
+                ),
+                tx["hash"]
+            )
+            for tx in transactions
+        ]
+        return batch_verify(items)
+    
     def get_pending_for_recipient(self, recipient: str) -> list:
         """
-        Obtiene todas las transacciones pendientes para un destinatario
+        Obtiene las transacciones pendientes en caché para un destinatario
+        
+        El listado completo está en la base de datos
         
         Args:
             recipient: Dirección del destinatario
@@ -134,16 +413,22 @@ class PrivacyEngine:
             Lista de transacciones pendientes
         """
         pending = []
-        for hash_key, tx in self.pending_transactions.items():
-            if tx.recipient.lower() == recipient.lower() and tx.status == "pending":
-                # No revelar todos los datos, solo lo necesario
-                pending.append({
-                    "hash": tx.hash,
-                    "amount": tx.amount,
-                    "token": tx.token,
-                    "timestamp": tx.timestamp,
-                    "sender": tx.sender  # En producción, esto también se ocultaría
-                })
+        assert recipient == recipient.lower(), "recipient must be lowercase"
+        for shard in self._shards:
+            for hash_key in tuple(shard.by_recipient.get(recipient, ())):
+                entry = shard.transactions.get(hash_key)
+                if entry is None:
+                    continue
+                tx = entry[0]
+                if tx.status == "pending":
+                    # No revelar todos los datos, solo lo necesario
+                    pending.append({
+                        "hash": tx.hash,
+                        "amount": tx.amount,
+                        "token": tx.token,
+                        "timestamp": tx.timestamp,
+                        "sender": tx.sender  # En producción, esto también se ocultaría
+                    })
         return pending
     
     def mark_as_claimed(self, transaction_hash: str, claimer: str) -> bool:
@@ -157,44 +442,46 @@ class PrivacyEngine:
         Returns:
             True si se marcó exitosamente
         """
-        if transaction_hash not in self.pending_transactions:
+        entry = self._lookup(transaction_hash)
+        if entry is None:
             return False
         
-        tx = self.pending_transactions[transaction_hash]
+        tx, details = entry
+        if tx.status != "pending":
+            return False
         
         # Verificar que quien reclama es el destinatario
-        if tx.recipient.lower() != claimer.lower():
+        assert claimer == claimer.lower(), "claimer must be lowercase"
+        if tx.recipient != claimer:
             return False
         
-        # Mover a reclamadas
+        # Sacar de la caché; el estado persistente lo actualiza quien llama
         tx.status = "claimed"
-        self.claimed_transactions[transaction_hash] = tx
-        del self.pending_transactions[transaction_hash]
+        details["status"] = "claimed"
+        self._shard(transaction_hash).evict(transaction_hash)
         
         return True
     
     def get_transaction_details(self, transaction_hash: str) -> Optional[Dict]:
         """
         Obtiene detalles completos de una transacción
-        """
-        # Buscar en pendientes
-        if transaction_hash in self.pending_transactions:
-            return asdict(self.pending_transactions[transaction_hash])
-        
-        # Buscar en reclamadas
-        if transaction_hash in self.claimed_transactions:
-            return asdict(self.claimed_transactions[transaction_hash])
         
-        return None
+        El dict devuelto es la vista cacheada; no debe modificarse
+        """
+        entry = self._lookup(transaction_hash)
+        if entry is None:
+            return None
+        return entry[1]
     
     def get_stats(self) -> Dict:
         """
-        Obtiene estadísticas del sistema
+        Obtiene estadísticas de la caché del motor
+        
+        Los totales del sistema están en la base de datos
         """
         return {
-            "total_pending": len(self.pending_transactions),
-            "total_claimed": len(self.claimed_transactions),
-            "total_transactions": len(self.pending_transactions) + len(self.claimed_transactions)
+            "cached_pending": sum(len(shard.transactions) for shard in self._shards),
+            "cache_size": self.cache_size
         }
 
 def generate_salt(length: int = 32) -> str:
@@ -219,7 +506,7 @@ def hash_data(data: str) -> str:
     Returns:
         Hash en formato hexadecimal con prefijo 0x
     """
-    return f"0x{hashlib.sha256(data.encode()).hexdigest()}"
+    return _sha256_hex(data.encode())
 
 def validate_ethereum_address(address: str) -> bool:
     """
@@ -234,16 +521,6 @@ def validate_ethereum_address(address: str) -> bool:
     if not address:
         return False
     
-    # Verificar formato básico
-    if not address.startswith("0x"):
-        return False
-    
-    if len(address) != 42:
-        return False
-    
-    # Verificar que son caracteres hexadecimales
-    try:
-        int(address[2:], 16)
-        return True
-    except ValueError:
-        return False
+    # Prefijo, longitud y caracteres hexadecimales en una sola pasada,
+    # sin parsear a entero ni lanzar excepciones
+    return _ETH_ADDRESS_RE.fullmatch(address) is not None
@@ -1,6 +1,7 @@
-from sqlalchemy import create_engine, Column, String, Float, Integer, Boolean, DateTime
+from sqlalchemy import event, inspect, insert, select, update, text, case, func, or_, Column, Index, String, Float, Integer, Boolean, DateTime
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime
 import os
 
@@ -23,6 +24,13 @@ class Transaction(Base):
     claimed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # Pendientes por destinatario: WHERE recipient=? AND status=?
+        Index("ix_tx_recipient_status", "recipient", "status"),
+        # Conteo de enviadas en get_user_stats
+        Index("ix_tx_sender", "sender"),
+    )
+    
 class User(Base):
     """Modelo de usuario"""
     __tablename__ = "users"
@@ -37,36 +45,109 @@ class User(Base):
 # Configuración de base de datos
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./invisible_transfers.db")
 
-# Crear engine
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-)
+def _async_database_url(url: str) -> str:
+    """Traduce la URL al driver asíncrono (aiosqlite / asyncpg) si no lo indica"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgresql:"):
+        return "postgresql+asyncpg:" + url[len("postgresql:"):]
+    return url
+
+# Crear engine asíncrono: las consultas no bloquean el event loop
+engine = create_async_engine(_async_database_url(DATABASE_URL))
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL permite lecturas concurrentes con escrituras y reduce fsyncs"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+# INSERT con soporte de ON CONFLICT según el dialecto
+upsert_insert = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
 
 # Crear sesión
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 
-def init_db():
+def _create_missing_indexes(sync_conn) -> list:
+    """
+    Crea los índices declarados en los modelos que falten en la BD
+    
+    create_all no añade índices a tablas que ya existían, así que las
+    instalaciones anteriores a los índices compuestos no los recibirían.
+    
+    Returns:
+        Nombres de las tablas en las que se creó algún índice
+    """
+    inspector = inspect(sync_conn)
+    tables = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing = [index for index in table.indexes if index.name not in existing]
+        for index in missing:
+            index.create(sync_conn, checkfirst=True)
+        if missing:
+            tables.append(table.name)
+    return tables
+
+async def init_db():
     """Inicializa la base de datos creando todas las tablas"""
-    Base.metadata.create_all(bind=engine)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        indexed_tables = await conn.run_sync(_create_missing_indexes)
+        
+        # Estadísticas solo para las tablas con índices nuevos, para que el
+        # planificador los use; no en cada arranque
+        for table_name in indexed_tables:
+            await conn.execute(text(f"ANALYZE {table_name}"))
 
-def get_db():
+async def get_db():
     """Generador de sesiones de base de datos"""
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 class DatabaseManager:
-    """Manejador de operaciones de base de datos"""
+    """
+    Manejador de operaciones de base de datos
+    
+    Los métodos reciben la sesión de la petición (ver get_db) y no hacen
+    commit; quien llama confirma una sola vez al final de la petición.
+    Las direcciones llegan en minúsculas y los tokens en mayúsculas.
+    """
     
     def __init__(self):
         self.engine = engine
         self.SessionLocal = SessionLocal
     
-    def create_transaction(
+    @staticmethod
+    def _transaction_values(rows: list) -> list:
+        """Filas para INSERT de transacciones"""
+        now = datetime.utcnow()
+        if __debug__:
+            for row in rows:
+                assert row["sender"] == row["sender"].lower(), "sender must be lowercase"
+                assert row["recipient"] == row["recipient"].lower(), "recipient must be lowercase"
+                assert row["token"] == row["token"].upper(), "token must be uppercase"
+        return [
+            {
+                "hash": row["hash"],
+                "sender": row["sender"],
+                "recipient": row["recipient"],
+                "amount": row["amount"],
+                "token": row["token"],
+                "salt": row["salt"],
+                "timestamp": row["timestamp"],
+                "status": "pending",
+                "created_at": now
+            }
+            for row in rows
+        ]
+    
+    async def create_transaction(
         self,
+        db: AsyncSession,
         hash: str,
         sender: str,
         recipient: str,
@@ -74,104 +155,123 @@ class DatabaseManager:
         token: str,
         salt: str,
         timestamp: int
-    ) -> Transaction:
+    ) -> None:
         """Crea una nueva transacción en la base de datos"""
-        db = self.SessionLocal()
-        try:
-            tx = Transaction(
-                hash=hash,
-                sender=sender.lower(),
-                recipient=recipient.lower(),
-                amount=amount,
-                token=token.upper(),
-                salt=salt,
-                timestamp=timestamp,
-                status="pending"
-            )
-            db.add(tx)
-            db.commit()
-            db.refresh(tx)
-            return tx
-        finally:
-            db.close()
-    
-    def get_transaction_by_hash(self, hash: str) -> Transaction:
+        await db.execute(insert(Transaction.__table__), self._transaction_values([{
+            "hash": hash,
+            "sender": sender,
+            "recipient": recipient,
+            "amount": amount,
+            "token": token,
+            "salt": salt,
+            "timestamp": timestamp
+        }]))
+    
+    async def create_transactions_batch(self, rows: list) -> None:
+        """
+        Inserta varias transacciones en una sola transacción de BD
+        
+        Usa un INSERT de SQLAlchemy Core (executemany) en lugar del ORM.
+        Abre su propia conexión: se llama desde la tarea de fondo, fuera
+        de cualquier petición.
+        """
+        if not rows:
+            return
+        async with self.engine.begin() as conn:
+            await conn.execute(insert(Transaction.__table__), self._transaction_values(rows))
+    
+    async def get_transaction_by_hash(self, db: AsyncSession, hash: str) -> Transaction:
         """Obtiene una transacción por su hash"""
-        db = self.SessionLocal()
-        try:
-            return db.query(Transaction).filter(Transaction.hash == hash).first()
-        finally:
-            db.close()
+        result = await db.execute(select(Transaction).where(Transaction.hash == hash))
+        return result.scalars().first()
     
-    def get_pending_transactions_for_recipient(self, recipient: str) -> list:
+    async def get_pending_transactions_for_recipient(self, db: AsyncSession, recipient: str) -> list:
         """Obtiene transacciones pendientes para un destinatario"""
-        db = self.SessionLocal()
-        try:
-            return db.query(Transaction).filter(
-                Transaction.recipient == recipient.lower(),
-                Transaction.status == "pending"
-            ).all()
-        finally:
-            db.close()
-    
-    def mark_transaction_claimed(self, hash: str) -> bool:
-        """Marca una transacción como reclamada"""
-        db = self.SessionLocal()
-        try:
-            tx = db.query(Transaction).filter(Transaction.hash == hash).first()
-            if tx and tx.status == "pending":
-                tx.status = "claimed"
-                tx.claimed_at = datetime.utcnow()
-                db.commit()
-                return True
-            return False
-        finally:
-            db.close()
-    
-    def get_user_stats(self, address: str) -> dict:
+        assert recipient == recipient.lower(), "recipient must be lowercase"
+        result = await db.execute(select(Transaction).where(
+            Transaction.recipient == recipient,
+            Transaction.status == "pending"
+        ))
+        return result.scalars().all()
+    
+    async def mark_transaction_claimed(self, db: AsyncSession, hash: str) -> bool:
+        """
+        Marca una transacción como reclamada
+        
+        UPDATE condicional: solo una petición concurrente puede pasar de
+        pending a claimed
+        """
+        result = await db.execute(
+            update(Transaction)
+            .where(Transaction.hash == hash, Transaction.status == "pending")
+            .values(status="claimed", claimed_at=datetime.utcnow())
+        )
+        return result.rowcount == 1
+    
+    async def get_user_stats(self, db: AsyncSession, address: str) -> dict:
         """Obtiene estadísticas de un usuario"""
-        db = self.SessionLocal()
-        try:
-            sent = db.query(Transaction).filter(
-                Transaction.sender == address.lower()
-            ).count()
-            
-            received = db.query(Transaction).filter(
-                Transaction.recipient == address.lower(),
-                Transaction.status == "claimed"
-            ).count()
-            
-            return {
-                "address": address,
-                "total_sent": sent,
-                "total_received": received
-            }
-        finally:
-            db.close()
+        assert address == address.lower(), "address must be lowercase"
+        
+        # Enviadas y recibidas en una sola consulta
+        result = await db.execute(select(
+            func.coalesce(func.sum(case((Transaction.sender == address, 1), else_=0)), 0),
+            func.coalesce(func.sum(case(
+                ((Transaction.recipient == address) & (Transaction.status == "claimed"), 1),
+                else_=0
+            )), 0)
+        ).where(
+            or_(Transaction.sender == address, Transaction.recipient == address)
+        ))
+        sent, received = result.one()
+        
+        return {
+            "address": address,
+            "total_sent": sent,
+            "total_received": received
+        }
+    
+    async def get_transaction_counts(self, db: AsyncSession) -> dict:
+        """Cuenta transacciones por estado"""
+        result = await db.execute(
+            select(Transaction.status, func.count(Transaction.id))
+            .group_by(Transaction.status)
+        )
+        counts = dict(result.all())
+        return {
+            "pending": counts.get("pending", 0),
+            "claimed": counts.get("claimed", 0),
+            "total": sum(counts.values())
+        }
     
-    def get_all_transactions(self, limit: int = 100) -> list:
+    async def get_all_transactions(self, db: AsyncSession, limit: int = 100) -> list:
         """Obtiene todas las transacciones con límite"""
-        db = self.SessionLocal()
-        try:
-            return db.query(Transaction).order_by(
-                Transaction.created_at.desc()
-            ).limit(limit).all()
-        finally:
-            db.close()
-    
-    def ensure_user_exists(self, address: str) -> User:
+        result = await db.execute(
+            select(Transaction).order_by(Transaction.created_at.desc()).limit(limit)
+        )
+        return result.scalars().all()
+    
+    async def ensure_user_exists(self, db: AsyncSession, address: str) -> None:
         """Asegura que un usuario exista en la base de datos"""
-        db = self.SessionLocal()
-        try:
-            user = db.query(User).filter(User.address == address.lower()).first()
-            if not user:
-                user = User(address=address.lower())
-                db.add(user)
-                db.commit()
-                db.refresh(user)
-            else:
-                user.last_activity = datetime.utcnow()
-                db.commit()
-            return user
-        finally:
-            db.close()
+        await self.ensure_users_exist(db, [address])
+    
+    async def ensure_users_exist(self, db: AsyncSession, addresses: list) -> None:
+        """
+        Crea los usuarios que falten y actualiza last_activity del resto
+        
+        Un único INSERT ... ON CONFLICT(address) DO UPDATE para todas las direcciones
+        """
+        now = datetime.utcnow()
+        # Sin duplicados: un mismo INSERT no puede actualizar dos veces la misma fila
+        unique_addresses = dict.fromkeys(addresses)
+        if __debug__:
+            for address in unique_addresses:
+                assert address == address.lower(), "address must be lowercase"
+        stmt = upsert_insert(User.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["address"],
+            set_={"last_activity": stmt.excluded.last_activity}
+        )
+        await db.execute(stmt, [
+            {"address": address, "created_at": now, "last_activity": now}
+            for address in unique_addresses
+        ])
@@ -1,11 +1,18 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, validator
-from typing import Optional, List
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field, validator
+from typing import Dict, Optional, List
+from decimal import Decimal
+import asyncio
+import logging
 import uvicorn
 from datetime import datetime
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from crypto_utils import (
+    HiddenTransaction,
     PrivacyEngine, 
     validate_ethereum_address,
     generate_salt,
@@ -19,11 +26,38 @@ from database import (
 )
 from uniswap_client import UniswapClient
 
+logger = logging.getLogger(__name__)
+
+def _stringify_big_ints(value):
+    """Convierte a str los enteros que no caben en 64 bits (p. ej. cantidades en wei)"""
+    if isinstance(value, dict):
+        return {key: _stringify_big_ints(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_stringify_big_ints(item) for item in value]
+    if isinstance(value, int) and not -2**63 <= value < 2**64:
+        return str(value)
+    return value
+
+class SafeORJSONResponse(ORJSONResponse):
+    """
+    ORJSONResponse que no falla con enteros de más de 64 bits
+    
+    orjson los rechaza con TypeError; en ese caso (raro) se reintenta
+    serializándolos como string, igual que documenta la API para wei.
+    """
+    
+    def render(self, content) -> bytes:
+        try:
+            return super().render(content)
+        except TypeError:
+            return super().render(_stringify_big_ints(content))
+
 # Inicializar FastAPI
 app = FastAPI(
     title="Invisible Transfer API",
     description="API para transacciones invisibles en blockchain con Uniswap v4",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=SafeORJSONResponse
 )
 
 # Configurar CORS
@@ -36,20 +70,147 @@ app.add_middleware(
 )
 
 # Inicializar componentes
-privacy_engine = PrivacyEngine()
 db_manager = DatabaseManager()
+privacy_engine = PrivacyEngine()
 uniswap_client = UniswapClient()
 
+async def load_transaction(db: AsyncSession, transaction_hash: str) -> None:
+    """Carga desde la BD una transacción que no esté en la caché del motor"""
+    if privacy_engine.is_cached(transaction_hash):
+        return
+    tx = await db_manager.get_transaction_by_hash(db, transaction_hash)
+    if tx:
+        privacy_engine.cache_transaction(HiddenTransaction(
+            sender=tx.sender,
+            recipient=tx.recipient,
+            amount=tx.amount,
+            token=tx.token,
+            salt=tx.salt,
+            timestamp=tx.timestamp,
+            hash=tx.hash,
+            status=tx.status
+        ))
+
+# Cola de escrituras de transacciones, vaciada en lotes por una tarea de fondo
+TX_FLUSH_INTERVAL = 0.005  # segundos
+TX_FLUSH_MAX_BATCH = 512
+TX_FLUSH_RETRY_DELAY = 0.1  # segundos, se duplica en cada reintento
+TX_FLUSH_MAX_RETRY_DELAY = 5.0
+TX_WRITE_WAIT_TIMEOUT = 10.0  # espera máxima de un claim por su inserción
+TX_SHUTDOWN_JOIN_TIMEOUT = 30.0  # espera máxima al vaciar la cola al apagar
+tx_queue: Optional[asyncio.Queue] = None
+tx_flush_task: Optional[asyncio.Task] = None
+
+# hash -> Future resuelto cuando la fila encolada ya está en la BD (o se
+# descartó); permite esperar una transacción concreta y no toda la cola
+pending_writes: Dict[str, asyncio.Future] = {}
+
+# Suscripción newHeads del cliente de Uniswap (solo si hay RPC_WS_URL)
+new_heads_task: Optional[asyncio.Task] = None
+
+async def flush_transaction_queue():
+    """Inserta en BD las transacciones encoladas, hasta TX_FLUSH_MAX_BATCH por lote"""
+    while True:
+        rows = [await tx_queue.get()]
+        try:
+            await asyncio.sleep(TX_FLUSH_INTERVAL)
+            while len(rows) < TX_FLUSH_MAX_BATCH and not tx_queue.empty():
+                rows.append(tx_queue.get_nowait())
+            await write_transaction_batch(rows)
+        except Exception:
+            # Ningún error debe terminar la tarea: sin ella nada más se escribiría
+            logger.exception("Unexpected error flushing %d transactions", len(rows))
+        finally:
+            for row in rows:
+                future = pending_writes.pop(row["hash"], None)
+                if future is not None and not future.done():
+                    future.set_result(None)
+                tx_queue.task_done()
+
+def is_transient_db_error(exc: Exception) -> bool:
+    """Errores tras los que reintentar la misma escritura puede funcionar"""
+    if isinstance(exc, OperationalError):
+        return True
+    return isinstance(exc, DBAPIError) and exc.connection_invalidated
+
+async def insert_with_retry(rows: list) -> None:
+    """Inserta filas reintentando con backoff solo los errores transitorios"""
+    delay = TX_FLUSH_RETRY_DELAY
+    while True:
+        try:
+            await db_manager.create_transactions_batch(rows)
+            return
+        except Exception as e:
+            if not is_transient_db_error(e):
+                raise
+            logger.warning(
+                "Error flushing %d transactions, retrying in %.1fs", len(rows), delay, exc_info=True
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, TX_FLUSH_MAX_RETRY_DELAY)
+
+async def write_transaction_batch(rows: list) -> None:
+    """
+    Escribe un lote de la cola sin perder filas ya confirmadas al cliente
+    
+    Los errores transitorios (BD caída, bloqueada...) se reintentan con
+    backoff hasta que el lote entra. Cualquier otro error puede deberse a
+    filas concretas, así que el lote se reparte fila a fila (con los mismos
+    reintentos) y únicamente se descartan las que la BD rechaza.
+    """
+    try:
+        await insert_with_retry(rows)
+        return
+    except Exception:
+        logger.exception("Batch of %d transactions rejected, retrying row by row", len(rows))
+    
+    for row in rows:
+        try:
+            await insert_with_retry([row])
+        except Exception:
+            logger.exception("Dropping transaction %s rejected by the database", row["hash"])
+
+async def wait_for_transaction_write(transaction_hash: str) -> None:
+    """Espera a que la inserción encolada de un hash llegue a la BD"""
+    future = pending_writes.get(transaction_hash)
+    if future is None:
+        return
+    try:
+        # shield: si esta petición se cancela, el Future compartido sigue vivo
+        await asyncio.wait_for(asyncio.shield(future), TX_WRITE_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Transaction is not stored yet, retry later")
+
 # Inicializar BD al arrancar
 @app.on_event("startup")
 async def startup_event():
-    init_db()
+    global tx_queue, tx_flush_task, new_heads_task
+    await init_db()
+    tx_queue = asyncio.Queue()
+    tx_flush_task = asyncio.create_task(flush_transaction_queue())
+    if uniswap_client.rpc_ws_url:
+        new_heads_task = asyncio.create_task(uniswap_client.watch_new_heads())
     print("✅ Database initialized")
     print("✅ Privacy Engine ready")
     print("✅ Uniswap Client initialized")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Esperar a que se escriban las transacciones pendientes, sin colgar el apagado
+    try:
+        await asyncio.wait_for(tx_queue.join(), TX_SHUTDOWN_JOIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error("Shutting down with %d transactions still queued", tx_queue.qsize())
+    tx_flush_task.cancel()
+    if new_heads_task:
+        new_heads_task.cancel()
+
 # Modelos Pydantic
+# Las direcciones se normalizan a minúsculas y los tokens a mayúsculas aquí,
+# una sola vez; PrivacyEngine y DatabaseManager los reciben ya normalizados
 class GenerateHashRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+    
     sender: str = Field(..., description="Dirección Ethereum del remitente")
     recipient: str = Field(..., description="Dirección Ethereum del destinatario")
     amount: float = Field(..., gt=0, description="Cantidad de tokens")
@@ -60,18 +221,14 @@ class GenerateHashRequest(BaseModel):
         if not validate_ethereum_address(v):
             raise ValueError('Invalid Ethereum address')
         return v.lower()
-
-class GenerateHashResponse(BaseModel):
-    hash: str
-    salt: str
-    timestamp: int
-    sender: str
-    recipient: str
-    amount: float
-    token: str
-    status: str
+    
+    @validator('token')
+    def normalize_token(cls, v):
+        return v.upper()
 
 class VerifyTransactionRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+    
     hash: str
     recipient: str
     
@@ -81,22 +238,37 @@ class VerifyTransactionRequest(BaseModel):
             raise ValueError('Invalid Ethereum address')
         return v.lower()
 
-class TransactionStatusResponse(BaseModel):
+class TransactionDataItem(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+    
     hash: str
-    status: str
-    sender: Optional[str]
-    amount: Optional[float]
-    token: Optional[str]
-    timestamp: Optional[int]
-    claimed_at: Optional[datetime]
+    sender: str
+    recipient: str
+    amount: float
+    token: str
+    salt: str
+    timestamp: int
+    
+    @validator('sender', 'recipient')
+    def normalize_address(cls, v):
+        return v.lower()
+    
+    @validator('token')
+    def normalize_token(cls, v):
+        return v.upper()
+
+class VerifyBatchRequest(BaseModel):
+    transactions: List[TransactionDataItem] = Field(..., max_length=1000)
 
 class UniswapQuoteRequest(BaseModel):
     token_in: str
     token_out: str
-    amount_in: float
-    decimals_in: int = 18
+    amount_in: Decimal
+    decimals_in: int = Field(18, ge=0, le=36)
 
 class ClaimTransactionRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+    
     hash: str
     claimer: str
     
@@ -118,6 +290,7 @@ async def root():
         "endpoints": {
             "generate_hash": "/api/generate-hash",
             "verify_transaction": "/api/verify-transaction",
+            "verify_batch": "/api/verify-batch",
             "transaction_status": "/api/transaction-status/{hash}",
             "pending_transfers": "/api/pending-transfers/{address}",
             "uniswap_quote": "/api/uniswap/quote",
@@ -125,8 +298,8 @@ async def root():
         }
     }
 
-@app.post("/api/generate-hash", response_model=GenerateHashResponse)
-async def generate_hash(request: GenerateHashRequest):
+@app.post("/api/generate-hash")
+async def generate_hash(request: GenerateHashRequest, db: AsyncSession = Depends(get_db)):
     """
     Genera un hash único para una transacción invisible
     
@@ -144,37 +317,38 @@ async def generate_hash(request: GenerateHashRequest):
             token=request.token
         )
         
-        # Guardar en base de datos
-        db_manager.create_transaction(
-            hash=result["hash"],
-            sender=request.sender,
-            recipient=request.recipient,
-            amount=request.amount,
-            token=request.token,
-            salt=result["salt"],
-            timestamp=result["timestamp"]
-        )
+        # Encolar para guardar en base de datos (escritura en lote)
+        pending_writes[result["hash"]] = asyncio.get_running_loop().create_future()
+        tx_queue.put_nowait({
+            "hash": result["hash"],
+            "sender": request.sender,
+            "recipient": request.recipient,
+            "amount": request.amount,
+            "token": request.token,
+            "salt": result["salt"],
+            "timestamp": result["timestamp"]
+        })
         
         # Asegurar que los usuarios existan
-        db_manager.ensure_user_exists(request.sender)
-        db_manager.ensure_user_exists(request.recipient)
+        await db_manager.ensure_users_exist(db, [request.sender, request.recipient])
+        await db.commit()
         
-        return GenerateHashResponse(
-            hash=result["hash"],
-            salt=result["salt"],
-            timestamp=result["timestamp"],
-            sender=request.sender,
-            recipient=request.recipient,
-            amount=request.amount,
-            token=request.token,
-            status=result["status"]
-        )
+        return {
+            "hash": result["hash"],
+            "salt": result["salt"],
+            "timestamp": result["timestamp"],
+            "sender": request.sender,
+            "recipient": request.recipient,
+            "amount": request.amount,
+            "token": request.token,
+            "status": result["status"]
+        }
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating hash: {str(e)}")
 
 @app.post("/api/verify-transaction")
-async def verify_transaction(request: VerifyTransactionRequest):
+async def verify_transaction(request: VerifyTransactionRequest, db: AsyncSession = Depends(get_db)):
     """
     Verifica si un hash corresponde a un destinatario específico
     
@@ -182,6 +356,8 @@ async def verify_transaction(request: VerifyTransactionRequest):
     - **recipient**: Dirección del destinatario a verificar
     """
     try:
+        await load_transaction(db, request.hash)
+        
         is_valid = privacy_engine.verify_recipient(
             transaction_hash=request.hash,
             recipient=request.recipient
@@ -208,8 +384,31 @@ async def verify_transaction(request: VerifyTransactionRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error verifying transaction: {str(e)}")
 
-@app.get("/api/transaction-status/{hash}", response_model=TransactionStatusResponse)
-async def get_transaction_status(hash: str):
+@app.post("/api/verify-batch")
+async def verify_batch(request: VerifyBatchRequest):
+    """
+    Verifica en lote que cada hash corresponde exactamente a sus datos
+    
+    - **transactions**: Lista de transacciones con hash, sender, recipient, amount, token, salt y timestamp
+    """
+    try:
+        results = privacy_engine.verify_transactions_batch(
+            [tx.dict() for tx in request.transactions]
+        )
+        
+        return {
+            "count": len(results),
+            "results": [
+                {"hash": tx.hash, "valid": valid}
+                for tx, valid in zip(request.transactions, results)
+            ]
+        }
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error verifying batch: {str(e)}")
+
+@app.get("/api/transaction-status/{hash}")
+async def get_transaction_status(hash: str, db: AsyncSession = Depends(get_db)):
     """
     Obtiene el estado de una transacción por su hash
     
@@ -217,7 +416,7 @@ async def get_transaction_status(hash: str):
     """
     try:
         # Buscar en base de datos
-        tx = db_manager.get_transaction_by_hash(hash)
+        tx = await db_manager.get_transaction_by_hash(db, hash)
         
         if not tx:
             # Buscar en engine
@@ -225,25 +424,25 @@ async def get_transaction_status(hash: str):
             if not tx_details:
                 raise HTTPException(status_code=404, detail="Transaction not found")
             
-            return TransactionStatusResponse(
-                hash=hash,
-                status=tx_details["status"],
-                sender=tx_details.get("sender"),
-                amount=tx_details.get("amount"),
-                token=tx_details.get("token"),
-                timestamp=tx_details.get("timestamp"),
-                claimed_at=None
-            )
+            return {
+                "hash": hash,
+                "status": tx_details["status"],
+                "sender": tx_details.get("sender"),
+                "amount": tx_details.get("amount"),
+                "token": tx_details.get("token"),
+                "timestamp": tx_details.get("timestamp"),
+                "claimed_at": None
+            }
         
-        return TransactionStatusResponse(
-            hash=tx.hash,
-            status=tx.status,
-            sender=tx.sender,
-            amount=tx.amount,
-            token=tx.token,
-            timestamp=tx.timestamp,
-            claimed_at=tx.claimed_at
-        )
+        return {
+            "hash": tx.hash,
+            "status": tx.status,
+            "sender": tx.sender,
+            "amount": tx.amount,
+            "token": tx.token,
+            "timestamp": tx.timestamp,
+            "claimed_at": tx.claimed_at
+        }
     
     except HTTPException:
         raise
@@ -251,7 +450,7 @@ async def get_transaction_status(hash: str):
         raise HTTPException(status_code=500, detail=f"Error getting transaction status: {str(e)}")
 
 @app.get("/api/pending-transfers/{address}")
-async def get_pending_transfers(address: str):
+async def get_pending_transfers(address: str, db: AsyncSession = Depends(get_db)):
     """
     Obtiene todas las transacciones pendientes para una dirección
     
@@ -265,7 +464,7 @@ async def get_pending_transfers(address: str):
         address = address.lower()
         
         # Obtener de base de datos
-        pending_txs = db_manager.get_pending_transactions_for_recipient(address)
+        pending_txs = await db_manager.get_pending_transactions_for_recipient(db, address)
         
         # Formatear respuesta
         result = []
@@ -291,7 +490,7 @@ async def get_pending_transfers(address: str):
         raise HTTPException(status_code=500, detail=f"Error getting pending transfers: {str(e)}")
 
 @app.post("/api/claim-transaction")
-async def claim_transaction(request: ClaimTransactionRequest):
+async def claim_transaction(request: ClaimTransactionRequest, db: AsyncSession = Depends(get_db)):
     """
     Marca una transacción como reclamada (llamar después de reclamo on-chain)
     
@@ -299,6 +498,10 @@ async def claim_transaction(request: ClaimTransactionRequest):
     - **claimer**: Dirección que reclama
     """
     try:
+        # Esperar solo a la inserción encolada de este hash, si la hay
+        await wait_for_transaction_write(request.hash)
+        await load_transaction(db, request.hash)
+        
         # Verificar que el claimer es el destinatario
         is_valid = privacy_engine.verify_recipient(request.hash, request.claimer)
         
@@ -308,14 +511,17 @@ async def claim_transaction(request: ClaimTransactionRequest):
                 detail="Claimer is not the recipient of this transaction"
             )
         
-        # Marcar como reclamada en engine
-        success = privacy_engine.mark_as_claimed(request.hash, request.claimer)
+        # Marcar en base de datos primero: el UPDATE condicional decide entre
+        # reclamos concurrentes
+        success = await db_manager.mark_transaction_claimed(db, request.hash)
         
         if not success:
             raise HTTPException(status_code=400, detail="Could not claim transaction")
         
-        # Marcar en base de datos
-        db_manager.mark_transaction_claimed(request.hash)
+        await db.commit()
+        
+        # Sacar de la caché del engine
+        privacy_engine.mark_as_claimed(request.hash, request.claimer)
         
         return {
             "success": True,
@@ -347,24 +553,28 @@ async def get_uniswap_quote(request: UniswapQuoteRequest):
             decimals_in=request.decimals_in
         )
         
+        # Las cantidades en wei superan los 64 bits; se devuelven como string
+        quote["amount_in"] = str(quote["amount_in"])
+        quote["amount_out_estimated"] = str(quote["amount_out_estimated"])
+        
         return quote
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting quote: {str(e)}")
 
 @app.get("/api/stats")
-async def get_stats():
+async def get_stats(db: AsyncSession = Depends(get_db)):
     """
     Obtiene estadísticas generales del sistema
     """
     try:
-        # Stats del privacy engine
-        engine_stats = privacy_engine.get_stats()
+        # Totales desde la base de datos (fuente de verdad)
+        counts = await db_manager.get_transaction_counts(db)
         
         return {
-            "total_transactions": engine_stats["total_transactions"],
-            "pending_transactions": engine_stats["total_pending"],
-            "claimed_transactions": engine_stats["total_claimed"],
+            "total_transactions": counts["total"],
+            "pending_transactions": counts["pending"],
+            "claimed_transactions": counts["claimed"],
             "timestamp": datetime.utcnow().isoformat()
         }
     
@@ -372,7 +582,7 @@ async def get_stats():
         raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
 
 @app.get("/api/user-stats/{address}")
-async def get_user_stats(address: str):
+async def get_user_stats(address: str, db: AsyncSession = Depends(get_db)):
     """
     Obtiene estadísticas de un usuario específico
     
@@ -383,7 +593,7 @@ async def get_user_stats(address: str):
         if not validate_ethereum_address(address):
             raise HTTPException(status_code=400, detail="Invalid Ethereum address")
         
-        stats = db_manager.get_user_stats(address)
+        stats = await db_manager.get_user_stats(db, address.lower())
         
         return stats
     
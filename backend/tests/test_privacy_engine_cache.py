@@ -0,0 +1,60 @@
+import unittest
+
+from crypto_utils import HiddenTransaction, PrivacyEngine
+
+
+def make_tx(i: int, recipient: str = "0x" + "22" * 20) -> HiddenTransaction:
+    return HiddenTransaction(
+        sender="0x" + "11" * 20,
+        recipient=recipient,
+        amount=1.0,
+        token="USDC",
+        salt="00" * 32,
+        timestamp=i,
+        hash="0x%064x" % i
+    )
+
+
+class ShardedCacheTest(unittest.TestCase):
+    """Caché LRU segmentada de PrivacyEngine"""
+    
+    def test_single_shard_evicts_least_recently_used(self):
+        engine = PrivacyEngine(cache_size=2, num_shards=1)
+        first, second, third = make_tx(1), make_tx(2), make_tx(3)
+        
+        engine.cache_transaction(first)
+        engine.cache_transaction(second)
+        # Tocar first lo convierte en el más reciente
+        self.assertTrue(engine.verify_recipient(first.hash, first.recipient))
+        engine.cache_transaction(third)
+        
+        self.assertTrue(engine.is_cached(first.hash))
+        self.assertFalse(engine.is_cached(second.hash))
+        self.assertTrue(engine.is_cached(third.hash))
+    
+    def test_capacity_is_bounded_per_shard(self):
+        engine = PrivacyEngine(cache_size=64, num_shards=8)
+        for i in range(1000):
+            engine.cache_transaction(make_tx(i))
+        
+        self.assertLessEqual(engine.get_stats()["cached_pending"], 64)
+        for shard in engine._shards:
+            self.assertLessEqual(len(shard.transactions), shard.capacity)
+    
+    def test_pending_for_recipient_spans_shards_and_claim_evicts(self):
+        engine = PrivacyEngine(cache_size=256, num_shards=16)
+        recipient = "0x" + "33" * 20
+        txs = [make_tx(i, recipient) for i in range(40)]
+        for tx in txs:
+            engine.cache_transaction(tx)
+        
+        pending = engine.get_pending_for_recipient(recipient)
+        self.assertEqual({tx["hash"] for tx in pending}, {tx.hash for tx in txs})
+        
+        engine.mark_as_claimed(txs[0].hash, recipient)
+        self.assertFalse(engine.is_cached(txs[0].hash))
+        self.assertEqual(len(engine.get_pending_for_recipient(recipient)), 39)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# La BD se configura al importar database, antes de cargar main
+_db_dir = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_db_dir}/test.db")
+
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import main
+
+
+SENDER = "0x" + "11" * 20
+RECIPIENT = "0x" + "22" * 20
+
+
+def tearDownModule():
+    shutil.rmtree(_db_dir, ignore_errors=True)
+
+
+class TransactionQueueTest(unittest.TestCase):
+    """Cola de inserciones en lote y espera por hash de los claims"""
+    
+    def generate(self, client):
+        response = client.post("/api/generate-hash", json={
+            "sender": SENDER,
+            "recipient": RECIPIENT,
+            "amount": 1.5,
+            "token": "usdc"
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.json()["hash"]
+    
+    def test_claim_waits_only_for_its_own_insert(self):
+        with TestClient(main.app) as client:
+            tx_hash = self.generate(client)
+            
+            response = client.post("/api/claim-transaction", json={
+                "hash": tx_hash,
+                "claimer": RECIPIENT
+            })
+            
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(tx_hash, main.pending_writes)
+    
+    def claim(self, client, tx_hash):
+        return client.post("/api/claim-transaction", json={
+            "hash": tx_hash,
+            "claimer": RECIPIENT
+        })
+    
+    def run_with_failures(self, failures):
+        """Genera y reclama un hash con create_transactions_batch fallando antes"""
+        original = main.db_manager.create_transactions_batch
+        calls = []
+        
+        async def flaky(rows):
+            calls.append(len(rows))
+            if len(calls) <= len(failures):
+                raise failures[len(calls) - 1]
+            await original(rows)
+        
+        with mock.patch.object(main.db_manager, "create_transactions_batch", flaky), \
+                mock.patch.object(main, "TX_FLUSH_RETRY_DELAY", 0.01):
+            with TestClient(main.app) as client:
+                response = self.claim(client, self.generate(client))
+                self.assertFalse(main.tx_flush_task.done())
+        
+        return response, calls
+    
+    def test_failed_batch_is_retried_not_dropped(self):
+        response, calls = self.run_with_failures([
+            OperationalError("INSERT", {}, Exception("database is locked"))
+        ])
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 2)
+    
+    def test_transient_error_in_row_fallback_is_retried(self):
+        response, calls = self.run_with_failures([
+            IntegrityError("INSERT", {}, Exception("UNIQUE constraint failed")),
+            OperationalError("INSERT", {}, Exception("database is locked"))
+        ])
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 3)
+    
+    def test_rejected_row_is_dropped_and_flusher_survives(self):
+        response, calls = self.run_with_failures([
+            AssertionError("sender must be lowercase"),
+            AssertionError("sender must be lowercase")
+        ])
+        
+        # Sin reintentos infinitos: lote y fila fallan una vez y la fila se
+        # descarta, así que el claim no encuentra nada que marcar en la BD
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(response.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+from unittest import mock
+
+from web3.exceptions import ContractLogicError
+
+import uniswap_client
+from uniswap_client import UniswapClient
+
+TOKEN = "0x" + "11" * 20
+OWNER = "0x" + "22" * 20
+SPENDER = "0x" + "33" * 20
+REVERTING_TOKEN = "0x" + "44" * 20
+
+
+class FakeChain:
+    """Sustituye el transporte RPC del cliente y registra cada lectura"""
+    
+    def __init__(self, client: UniswapClient):
+        self.block = 100
+        self.allowances = {}
+        self.reads = []
+        self.reverting = set()
+        client._block_number = lambda: self.block
+        client._eth_call = self.eth_call
+        client._aggregate3 = self.aggregate3
+    
+    def read(self, to: str, data: bytes, block: int) -> bytes:
+        owner = "0x" + data[16:36].hex()
+        spender = "0x" + data[48:68].hex()
+        self.reads.append((to.lower(), owner, spender, block))
+        return self.allowances.get((to.lower(), owner, spender), 0).to_bytes(32, 'big')
+    
+    def eth_call(self, to: str, data: bytes, block: int) -> bytes:
+        result = self.read(to, data, block)
+        if to.lower() in self.reverting:
+            raise ContractLogicError("execution reverted")
+        return result
+    
+    def aggregate3(self, calls, block):
+        return [
+            (target.lower() not in self.reverting, self.read(target, data, block))
+            for target, _, data in calls
+        ]
+
+
+class AllowanceCacheTest(unittest.TestCase):
+    """Caché LRU de allowances por bloque de UniswapClient"""
+    
+    def setUp(self):
+        self.client = UniswapClient("http://localhost:8545")
+        self.chain = FakeChain(self.client)
+        self.chain.allowances[(TOKEN, OWNER, SPENDER)] = 7
+    
+    def test_same_block_is_served_from_cache(self):
+        self.assertEqual(self.client.check_allowance(TOKEN, OWNER, SPENDER), 7)
+        self.assertEqual(self.client.check_allowance(TOKEN, OWNER, SPENDER), 7)
+        
+        self.assertEqual(len(self.chain.reads), 1)
+    
+    def test_only_missing_entries_are_fetched(self):
+        self.client.check_allowance(TOKEN, OWNER, SPENDER)
+        self.chain.reads.clear()
+        
+        result = self.client.check_allowances_batch([
+            (TOKEN, OWNER, SPENDER),
+            (TOKEN, SPENDER, OWNER)
+        ])
+        
+        self.assertEqual(result, [7, 0])
+        self.assertEqual(self.chain.reads, [(TOKEN, SPENDER, OWNER, 100)])
+    
+    def test_new_block_invalidates_entries(self):
+        self.client.check_allowance(TOKEN, OWNER, SPENDER)
+        self.chain.block = 101
+        self.chain.allowances[(TOKEN, OWNER, SPENDER)] = 9
+        
+        self.assertEqual(self.client.check_allowance(TOKEN, OWNER, SPENDER), 9)
+        self.assertEqual([read[3] for read in self.chain.reads], [100, 101])
+    
+    def test_address_spelling_shares_one_entry(self):
+        self.client.check_allowance(TOKEN, OWNER, SPENDER)
+        
+        self.assertEqual(self.client.check_allowance(TOKEN[2:], OWNER.upper()[2:], SPENDER), 7)
+        self.assertEqual(len(self.chain.reads), 1)
+    
+    def test_capacity_is_bounded(self):
+        with mock.patch.object(uniswap_client, "ALLOWANCE_CACHE_SIZE", 4):
+            triples = [(TOKEN, "0x%040x" % i, SPENDER) for i in range(1, 11)]
+            self.client.check_allowances_batch(triples)
+        
+        self.assertEqual(len(self.client._allowance_cache), 4)
+    
+    def test_reverting_token_does_not_discard_cache_hits(self):
+        self.chain.reverting.add(REVERTING_TOKEN)
+        triples = [(TOKEN, OWNER, SPENDER), (REVERTING_TOKEN, OWNER, SPENDER)]
+        
+        # En frío ambos van por aggregate3; en caliente solo falla uno y se
+        # llama directamente al token que revierte
+        self.assertEqual(self.client.check_allowances_batch(triples), [7, 0])
+        self.client._allowance_cache.clear()
+        self.client.check_allowance(TOKEN, OWNER, SPENDER)
+        self.assertEqual(self.client.check_allowances_batch(triples), [7, 0])
+    
+    def test_empty_block_number_cache_is_stale_right_after_boot(self):
+        client = UniswapClient("http://localhost:8545")
+        
+        # time.monotonic() cuenta desde el arranque y puede ser menor que el TTL
+        with mock.patch.object(uniswap_client.time, "monotonic", return_value=1.0):
+            self.assertIsNone(client._cached_block_number())
+    
+    def test_invalid_address_raises(self):
+        with self.assertRaises(ValueError):
+            self.client.check_allowance(TOKEN, "0x1234", SPENDER)
+        self.assertEqual(self.chain.reads, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+from unittest import mock
+
+import uniswap_client
+from uniswap_client import UniswapClient
+
+
+class LatestTimestampCacheTest(unittest.TestCase):
+    """Caché con TTL del timestamp del último bloque"""
+    
+    def setUp(self):
+        self.client = UniswapClient("http://localhost:8545")
+    
+    def test_empty_cache_is_stale_right_after_boot(self):
+        # time.monotonic() cuenta desde el arranque: en una VM recién creada
+        # es menor que LATEST_TS_TTL
+        with mock.patch.object(uniswap_client.time, "monotonic", return_value=1.0):
+            self.assertIsNone(self.client._cached_latest_timestamp())
+    
+    def test_fresh_entry_is_reused_within_ttl(self):
+        with mock.patch.object(uniswap_client.time, "monotonic", return_value=1000.0):
+            self.client._latest_ts_cache = (999.0, 1700000000)
+            self.assertEqual(self.client._cached_latest_timestamp(), 1700000000)
+            
+            self.client._latest_ts_cache = (1000.0 - uniswap_client.LATEST_TS_TTL, 1700000000)
+            self.assertIsNone(self.client._cached_latest_timestamp())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+from decimal import Decimal
+
+from uniswap_client import _to_wei
+
+
+class ToWeiTest(unittest.TestCase):
+    """Escalado exacto de cantidades a la unidad mínima del token"""
+    
+    def test_keeps_more_digits_than_the_decimal_context(self):
+        self.assertEqual(
+            _to_wei(Decimal('12345678901.234567890123456789'), 18),
+            12345678901234567890123456789
+        )
+    
+    def test_truncates_fractions_instead_of_rounding(self):
+        self.assertEqual(
+            _to_wei(Decimal('0.99999999999999999999999999999'), 18),
+            999999999999999999
+        )
+        self.assertEqual(_to_wei(Decimal('1.0000009'), 6), 1000000)
+    
+    def test_negative_amounts_truncate_toward_zero(self):
+        self.assertEqual(_to_wei(Decimal('-1.0000009'), 6), -1000000)
+    
+    def test_int_and_float_inputs(self):
+        self.assertEqual(_to_wei(3, 18), 3 * 10 ** 18)
+        self.assertEqual(_to_wei(1.5, 6), 1500000)
+        self.assertEqual(_to_wei(Decimal('1E+2'), 0), 100)
+    
+    def test_decimals_out_of_range_raise(self):
+        for decimals in (-1, 37):
+            with self.assertRaises(ValueError):
+                _to_wei(Decimal('1'), decimals)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,97 +1,309 @@
-from web3 import Web3
-from typing import Dict, Optional
+from web3 import AsyncHTTPProvider, AsyncWeb3, HTTPProvider, Web3
+from web3.datastructures import AttributeDict
+from web3.exceptions import ContractLogicError
+from eth_abi import decode as abi_decode, encode as abi_encode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple, Union
+import asyncio
+import functools
 import os
 import json
+import re
+import time
+import orjson
+import requests
+import websockets
 
-class UniswapClient:
-    """Cliente para interactuar con Uniswap v4"""
+# Multicall3 está desplegado en la misma dirección en todas las cadenas EVM
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+
+def _selector(signature: str) -> bytes:
+    """Selector de función: primeros 4 bytes de keccak256 de la firma"""
+    return bytes(Web3.keccak(text=signature)[:4])
+
+
+# Selectores calculados una sola vez al importar el módulo
+_SEL_ALLOWANCE = _selector("allowance(address,address)")
+_SEL_EXTSLOAD = _selector("extsload(bytes32)")
+_SEL_AGGREGATE3 = _selector("aggregate3((address,bool,bytes)[])")
+
+# ABIs de los contratos del proyecto. En producción, cargarlos una única vez
+# al importar el módulo (json.load) y guardar aquí la lista ya parseada
+_ABIS = {
+    "InvisibleTransfer": (),
+    "UniswapV4Hook": (),
+    "TokenWrapper": ()
+}
+
+# Potencias de 10 precalculadas para escalar cantidades por los decimales del token
+_POW10 = tuple(10 ** i for i in range(37))
+
+# tickSpacing estándar de Uniswap para cada fee tier
+FEE_TICK_SPACING = {100: 1, 500: 10, 3000: 60, 10000: 200}
+
+ZERO_ADDRESS = "0x" + "00" * 20
+
+# Palabra ABI de 32 bytes para el bool true, en hexadecimal
+_ABI_TRUE_WORD = '00' * 31 + '01'
+
+# Layout de almacenamiento del PoolManager (StateLibrary de v4-core): el estado
+# de cada pool vive en keccak256(poolId . POOLS_SLOT); slot0 en la primera
+# palabra y la liquidez LIQUIDITY_OFFSET palabras más allá
+POOLS_SLOT = (6).to_bytes(32, 'big')
+LIQUIDITY_OFFSET = 3
+
+# bytes32 en hexadecimal sin prefijo: exactamente 64 caracteres
+_HEX32_RE = re.compile(r"[0-9a-fA-F]{64}")
+
+# Segundos durante los que se reutiliza el timestamp del último bloque
+# (en mainnet sale un bloque cada ~12s)
+LATEST_TS_TTL = 4.0
+
+# Con la suscripción newHeads activa, el timestamp se da por bueno mientras la
+# última cabecera recibida no sea más antigua que esto
+WS_HEAD_MAX_AGE = 30.0
+
+# Segundos durante los que se reutiliza el número de bloque actual
+BLOCK_NUMBER_TTL = 2.0
+
+# Entradas máximas de la caché LRU de allowances
+ALLOWANCE_CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=8192)
+def _checksum(addr: str) -> str:
+    """Web3.to_checksum_address memoizado (cada llamada calcula un keccak-256)"""
+    return Web3.to_checksum_address(addr)
+
+
+def _rpc_json_default(obj):
+    """Tipos de web3 que orjson no serializa por sí mismo"""
+    if isinstance(obj, AttributeDict):
+        return dict(obj)
+    if isinstance(obj, bytes):
+        return Web3.to_hex(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class _OrjsonCodecMixin:
+    """
+    Codifica y decodifica los mensajes JSON-RPC con orjson
+    
+    orjson trabaja directamente con bytes, que es lo que viaja por HTTP. Las
+    cantidades JSON-RPC van como strings hexadecimales, así que no hay enteros
+    de más de 64 bits que orjson no sepa manejar.
+    """
+    
+    def encode_rpc_request(self, method, params) -> bytes:
+        return orjson.dumps(
+            {
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": params or [],
+                "id": next(self.request_counter)
+            },
+            default=_rpc_json_default
+        )
+    
+    def decode_rpc_response(self, raw_response):
+        return orjson.loads(raw_response)
+
+
+class _OrjsonHTTPProvider(_OrjsonCodecMixin, HTTPProvider):
+    """HTTPProvider con codec orjson"""
+
+
+class _OrjsonAsyncHTTPProvider(_OrjsonCodecMixin, AsyncHTTPProvider):
+    """AsyncHTTPProvider con codec orjson"""
+
+
+def _make_rpc_session() -> requests.Session:
+    """
+    Sesión HTTP con pool de conexiones persistentes para el nodo RPC
+    
+    Reutiliza las conexiones TCP/TLS entre llamadas y reintenta los fallos
+    transitorios del nodo (las llamadas JSON-RPC que hacemos son de lectura).
+    """
+    retry = Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset({"POST"})
+    )
+    adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _to_wei(amount: Union[int, Decimal], decimals: int) -> int:
+    """
+    Escala una cantidad a la unidad mínima del token sin pasar por float
+    
+    Args:
+        amount: Cantidad en unidades del token (int o Decimal)
+        decimals: Decimales del token
+        
+    Returns:
+        Cantidad entera en la unidad mínima (se truncan las fracciones);
+        ValueError si decimals está fuera de 0..36
+    """
+    # Un índice negativo en _POW10 daría una potencia equivocada sin fallar
+    if not 0 <= decimals < len(_POW10):
+        raise ValueError(f"Decimales fuera de rango (0..{len(_POW10) - 1}): {decimals}")
+    if isinstance(amount, int):
+        return amount * _POW10[decimals]
+    if not isinstance(amount, Decimal):
+        # Compatibilidad con llamadores que aún pasan float
+        amount = Decimal(str(amount))
+    # Aritmética entera exacta: scaleb redondearía al contexto de 28 dígitos.
+    # El signo va aparte para que // trunque hacia cero y no hacia -inf
+    numerator, denominator = amount.as_integer_ratio()
+    scaled = abs(numerator) * _POW10[decimals] // denominator
+    return scaled if numerator >= 0 else -scaled
+
+
+@functools.lru_cache(maxsize=1024)
+def _pool_key(token0: str, token1: str, fee: int, hooks: str) -> Tuple:
+    """
+    Calcula el PoolKey y el PoolId de Uniswap v4 para un par
+    
+    Args:
+        token0: Primera dirección de token
+        token1: Segunda dirección de token
+        fee: Fee tier
+        hooks: Dirección del hook (ZERO_ADDRESS si no hay)
+        
+    Returns:
+        Tupla (currency0, currency1, fee, tick_spacing, hooks, pool_id);
+        ValueError si el fee tier no tiene un tickSpacing conocido
+    """
+    # Un tickSpacing inventado daría un PoolId que no existe on-chain
+    if fee not in FEE_TICK_SPACING:
+        raise ValueError(f"Fee tier sin tickSpacing conocido: {fee}")
+    
+    # En v4 currency0 es siempre la dirección menor
+    currency0, currency1 = sorted((token0.lower(), token1.lower()))
+    tick_spacing = FEE_TICK_SPACING[fee]
+    hooks = hooks.lower()
+    
+    # PoolId = keccak256(abi.encode(PoolKey))
+    pool_id = Web3.keccak(abi_encode(
+        ["address", "address", "uint24", "int24", "address"],
+        [currency0, currency1, fee, tick_spacing, hooks]
+    )).hex()
+    
+    return currency0, currency1, fee, tick_spacing, hooks, pool_id
+
+
+def _strip0x(value: str) -> str:
+    """Quita el prefijo 0x de un string hexadecimal (slice en vez de startswith)"""
+    return value[2:] if value[:2] == '0x' else value
+
+
+def _encode_allowance(owner: str, spender: str) -> bytes:
+    """
+    Calldata de allowance(owner, spender) sin pasar por el codificador ABI
     
-    def __init__(self, rpc_url: str = None, chain_id: int = 1):
+    _checksum valida las direcciones (ValueError si no son 20 bytes en hex)
+    y acepta entradas con o sin prefijo 0x.
+    """
+    return (
+        _SEL_ALLOWANCE
+        + bytes.fromhex(_checksum(owner)[2:].rjust(64, '0'))
+        + bytes.fromhex(_checksum(spender)[2:].rjust(64, '0'))
+    )
+
+
+class _UniswapClientBase:
+    """
+    Estado y lógica compartidos por UniswapClient y AsyncUniswapClient
+    
+    Aquí solo vive lo que no hace E/S con el nodo (codificación, decodificación
+    y cachés); cada subclase implementa las llamadas RPC con su propio estilo,
+    síncrono o asíncrono.
+    """
+    
+    def __init__(self, rpc_url: str = None, chain_id: int = 1, rpc_ws_url: str = None):
         """
-        Inicializa el cliente de Uniswap
+        Inicializa el estado común del cliente
         
         Args:
             rpc_url: URL del nodo RPC
             chain_id: ID de la cadena (1=Mainnet, 11155111=Sepolia, etc.)
+            rpc_ws_url: URL WebSocket del nodo para la suscripción newHeads (opcional)
         """
         self.rpc_url = rpc_url or os.getenv("RPC_URL", "http://localhost:8545")
+        self.rpc_ws_url = rpc_ws_url or os.getenv("RPC_WS_URL", "")
         self.chain_id = chain_id
-        self.w3 = Web3(Web3.HTTPProvider(self.rpc_url))
         
-        # Verificar conexión
-        if not self.w3.is_connected():
-            print(f"Warning: No se puede conectar a {self.rpc_url}")
+        # (instante monotónico de la lectura, timestamp del bloque); -inf marca
+        # "nunca leído": con 0.0 la entrada vacía parecería fresca justo tras
+        # arrancar la máquina, porque time.monotonic() cuenta desde el boot
+        self._latest_ts_cache = (float('-inf'), 0)
+        self._ws_live = False
+        # (instante, número de bloque), con el mismo centinela: si no, tras el
+        # boot se leerían y cachearían allowances en el bloque 0
+        self._block_number_cache = (float('-inf'), 0)
+        
+        # LRU (token, owner, spender, bloque) -> allowance; al avanzar de bloque
+        # las claves cambian y las entradas viejas salen por el extremo LRU
+        self._allowance_cache: "OrderedDict[Tuple[str, str, str, int], int]" = OrderedDict()
+        
+        # La conexión no se comprueba aquí (costaría un RPC por instancia);
+        # usar health_check() cuando haga falta
         
         # Direcciones de contratos (placeholder - actualizar con direcciones reales)
         self.pool_manager_address = os.getenv("POOL_MANAGER_ADDRESS", "")
         self.hook_address = os.getenv("HOOK_ADDRESS", "")
         self.invisible_transfer_address = os.getenv("INVISIBLE_TRANSFER_ADDRESS", "")
     
-    def get_quote(
+    def _build_quotes(
         self,
-        token_in: str,
-        token_out: str,
-        amount_in: float,
-        decimals_in: int = 18
-    ) -> Dict:
-        """
-        Obtiene una cotización de Uniswap v4
-        
-        Args:
-            token_in: Dirección del token de entrada
-            token_out: Dirección del token de salida
-            amount_in: Cantidad de tokens de entrada
-            decimals_in: Decimales del token de entrada
+        reqs: List[Tuple[str, str, Union[int, Decimal], int]]
+    ) -> List[Dict]:
+        """Cotizaciones simuladas para una lista de (token_in, token_out, amount_in, decimals_in)"""
+        # En una implementación real, se agruparían las llamadas al quoter de
+        # Uniswap v4 en un único POST JSON-RPC. Por ahora, datos simulados
+        quotes = []
+        for token_in, token_out, amount_in, decimals_in in reqs:
+            amount_in_wei = _to_wei(amount_in, decimals_in)
             
-        Returns:
-            Dict con información de la cotización
-        """
-        # En una implementación real, se llamaría al PoolManager de Uniswap v4
-        # Por ahora, devolvemos datos simulados
-        
-        amount_in_wei = int(amount_in * (10 ** decimals_in))
-        
-        # Simulación de cotización (en producción, llamar al contrato real)
-        estimated_out = amount_in_wei * 0.98  # Simulación con 2% de slippage
+            # Simulación de cotización (en producción, llamar al contrato real)
+            estimated_out = amount_in_wei * 98 // 100  # Simulación con 2% de slippage
+            
+            quotes.append({
+                "token_in": token_in,
+                "token_out": token_out,
+                "amount_in": amount_in_wei,
+                "amount_out_estimated": estimated_out,
+                "price_impact": 2.0,
+                "gas_estimated": 150000,
+                "route": [token_in, token_out]
+            })
         
-        return {
-            "token_in": token_in,
-            "token_out": token_out,
-            "amount_in": amount_in_wei,
-            "amount_out_estimated": int(estimated_out),
-            "price_impact": 2.0,
-            "gas_estimated": 150000,
-            "route": [token_in, token_out]
-        }
+        return quotes
     
-    def prepare_swap_data(
+    def _swap_data(
         self,
         token_in: str,
         token_out: str,
-        amount_in: float,
-        min_amount_out: float,
+        amount_in: Union[int, Decimal],
+        min_amount_out: Union[int, Decimal],
         recipient: str,
-        hidden_hash: Optional[str] = None
+        hidden_hash: Optional[str],
+        timestamp: int
     ) -> Dict:
-        """
-        Prepara datos para ejecutar un swap
-        
-        Args:
-            token_in: Token de entrada
-            token_out: Token de salida
-            amount_in: Cantidad de entrada
-            min_amount_out: Cantidad mínima de salida
-            recipient: Destinatario
-            hidden_hash: Hash de transacción invisible (opcional)
-            
-        Returns:
-            Dict con datos del swap
-        """
+        """Arma el dict de prepare_swap_data a partir del timestamp del bloque"""
         # Preparar hookData si hay transacción invisible
         hook_data = "0x"
         if hidden_hash:
             # Codificar hidden_hash y flag isInvisible
-            # En producción, usar abi.encode de Web3
             hook_data = self.encode_invisible_swap_data(hidden_hash)
         
         return {
@@ -101,9 +313,68 @@ class UniswapClient:
             "min_amount_out": min_amount_out,
             "recipient": recipient,
             "hook_data": hook_data,
-            "deadline": self.w3.eth.get_block('latest')['timestamp'] + 1800  # 30 minutos
+            "deadline": timestamp + 1800  # 30 minutos
         }
     
+    def _cached_latest_timestamp(self) -> Optional[int]:
+        """Devuelve el timestamp cacheado si sigue dentro del TTL"""
+        fetched_at, timestamp = self._latest_ts_cache
+        age = time.monotonic() - fetched_at
+        
+        # Con newHeads cada bloque nuevo llega solo: no hace falta el TTL corto
+        if age < LATEST_TS_TTL or (self._ws_live and age < WS_HEAD_MAX_AGE):
+            return timestamp
+        return None
+    
+    def _cached_block_number(self) -> Optional[int]:
+        """Devuelve el número de bloque cacheado si sigue dentro del TTL"""
+        fetched_at, block = self._block_number_cache
+        if time.monotonic() - fetched_at < BLOCK_NUMBER_TTL:
+            return block
+        return None
+    
+    async def watch_new_heads(self):
+        """
+        Mantiene el timestamp del último bloque al día vía newHeads
+        
+        Se suscribe por WebSocket a eth_subscribe("newHeads") y guarda el
+        timestamp de cada cabecera, de modo que prepare_swap_data lo lee de
+        memoria. Si la conexión cae, reconecta con backoff y mientras tanto se
+        vuelve al TTL normal. Sin rpc_ws_url no hace nada.
+        """
+        if not self.rpc_ws_url:
+            return
+        
+        delay = 1.0
+        while True:
+            try:
+                async with websockets.connect(self.rpc_ws_url) as ws:
+                    await ws.send(orjson.dumps({
+                        "jsonrpc": "2.0",
+                        "id": 1,
+                        "method": "eth_subscribe",
+                        "params": ["newHeads"]
+                    }).decode())
+                    
+                    response = orjson.loads(await ws.recv())
+                    if "error" in response:
+                        raise ValueError(response["error"])
+                    delay = 1.0
+                    
+                    async for message in ws:
+                        header = orjson.loads(message)["params"]["result"]
+                        self._latest_ts_cache = (time.monotonic(), int(header["timestamp"], 16))
+                        self._ws_live = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Warning: suscripción newHeads interrumpida: {e}")
+            finally:
+                self._ws_live = False
+            
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+    
     def encode_invisible_swap_data(self, hidden_hash: str) -> str:
         """
         Codifica datos para swap invisible
@@ -112,47 +383,87 @@ class UniswapClient:
             hidden_hash: Hash de la transacción invisible
             
         Returns:
-            Datos codificados en hexadecimal
+            Datos codificados en hexadecimal; ValueError si el hash no es un
+            bytes32 (64 caracteres hex, con o sin prefijo 0x)
         """
-        # Convertir hash a bytes32
-        hash_bytes = bytes.fromhex(hidden_hash[2:] if hidden_hash.startswith('0x') else hidden_hash)
-        
-        # Codificar: (bytes32 hiddenHash, bool isInvisible)
-        # En producción, usar abi.encode real
-        is_invisible = True
-        
-        # Simulación simple de encoding
-        encoded = f"0x{hash_bytes.hex()}{'01' if is_invisible else '00'}"
+        hash_hex = _strip0x(hidden_hash)
+        # Sin rellenar: un hash corto o con caracteres no hex es un error del llamador
+        if not _HEX32_RE.fullmatch(hash_hex):
+            raise ValueError(f"hidden_hash no es un bytes32 en hexadecimal: {hidden_hash!r}")
         
-        return encoded
+        # abi.encode(bytes32 hiddenHash, bool isInvisible): dos palabras de 32 bytes,
+        # la segunda es el bool true con padding a la izquierda
+        return '0x' + hash_hex.lower() + _ABI_TRUE_WORD
     
-    def get_pool_info(self, token0: str, token1: str, fee: int = 3000) -> Dict:
+    def _simulated_pool_state(self) -> Dict:
+        """Estado de pool simulado cuando no hay PoolManager configurado"""
+        return {
+            "liquidity": 1000000000000000000,  # Simulado
+            "sqrt_price_x96": 79228162514264337593543950336,  # Simulado
+            "tick": 0
+        }
+    
+    def _pool_state_calls(self, metas: List[Dict]) -> List[Tuple]:
+        """Llamadas de Multicall3 (extsload de slot0 y liquidez) para cada pool"""
+        pool_manager = _checksum(self.pool_manager_address)
+        calls = []
+        for meta in metas:
+            state_slot = int.from_bytes(
+                Web3.keccak(bytes.fromhex(_strip0x(meta["pool_id"])) + POOLS_SLOT), 'big'
+            )
+            calls.append((pool_manager, False, _SEL_EXTSLOAD + state_slot.to_bytes(32, 'big')))
+            calls.append((
+                pool_manager,
+                False,
+                _SEL_EXTSLOAD + (state_slot + LIQUIDITY_OFFSET).to_bytes(32, 'big')
+            ))
+        return calls
+    
+    def _decode_pool_states(self, results: List[Tuple[bool, bytes]]) -> List[Dict]:
+        """Decodifica pares (slot0, liquidez) devueltos por aggregate3"""
+        states = []
+        for i in range(0, len(results), 2):
+            slot0 = int.from_bytes(results[i][1][:32], 'big')
+            liquidity = int.from_bytes(results[i + 1][1][:32], 'big')
+            
+            # slot0 empaqueta sqrtPriceX96 (160 bits) | tick (int24) | fees
+            tick = (slot0 >> 160) & 0xFFFFFF
+            if tick >= 1 << 23:
+                tick -= 1 << 24
+            
+            states.append({
+                "liquidity": liquidity & ((1 << 128) - 1),
+                "sqrt_price_x96": slot0 & ((1 << 160) - 1),
+                "tick": tick
+            })
+        return states
+    
+    def _get_pool_meta(self, token0: str, token1: str, fee: int) -> Dict:
         """
-        Obtiene información de un pool de Uniswap v4
+        Metadatos inmutables de un pool (PoolKey y PoolId)
         
-        Args:
-            token0: Primera dirección de token
-            token1: Segunda dirección de token
-            fee: Fee tier (3000 = 0.3%)
-            
-        Returns:
-            Dict con información del pool
+        token0/token1 se devuelven tal como los pasó el llamador; el orden
+        canónico de v4 va aparte en currency0/currency1.
         """
-        # En producción, consultar PoolManager real
+        currency0, currency1, fee, tick_spacing, hooks, pool_id = _pool_key(
+            token0, token1, fee, self.hook_address or ZERO_ADDRESS
+        )
         return {
+            "pool_id": pool_id,
             "token0": token0,
             "token1": token1,
+            "currency0": currency0,
+            "currency1": currency1,
             "fee": fee,
-            "liquidity": 1000000000000000000,  # Simulado
-            "sqrt_price_x96": 79228162514264337593543950336,  # Simulado
-            "tick": 0
+            "tick_spacing": tick_spacing,
+            "hooks": hooks
         }
     
     def estimate_gas_for_swap(
         self,
         token_in: str,
         token_out: str,
-        amount_in: float
+        amount_in: Union[int, Decimal]
     ) -> int:
         """
         Estima gas para un swap
@@ -169,7 +480,7 @@ class UniswapClient:
         
         return base_gas
     
-    def get_contract_abi(self, contract_name: str) -> list:
+    def get_contract_abi(self, contract_name: str) -> tuple:
         """
         Obtiene el ABI de un contrato
         
@@ -177,16 +488,246 @@ class UniswapClient:
             contract_name: Nombre del contrato
             
         Returns:
-            ABI como lista
+            ABI como tupla (compartida, no debe modificarse)
         """
-        # En producción, leer desde archivos o API
-        abis = {
-            "InvisibleTransfer": [],
-            "UniswapV4Hook": [],
-            "TokenWrapper": []
-        }
+        return _ABIS.get(contract_name, ())
+    
+    def _aggregate3_calldata(self, calls: List[Tuple]) -> bytes:
+        """
+        Calldata de Multicall3.aggregate3
+        
+        Se arma con el selector precalculado en lugar de buscar la función en
+        el ABI del contrato en cada llamada.
+        """
+        return _SEL_AGGREGATE3 + abi_encode(["(address,bool,bytes)[]"], [calls])
+    
+    def _decode_aggregate3(self, result: bytes) -> List[Tuple[bool, bytes]]:
+        """Decodifica el retorno de aggregate3 en tuplas (success, returnData)"""
+        return abi_decode(["(bool,bytes)[]"], result)[0]
+    
+    def _normalize_triples(
+        self,
+        triples: List[Tuple[str, str, str]]
+    ) -> List[Tuple[str, str, str]]:
+        """
+        Normaliza (token, owner, spender) a direcciones checksum
+        
+        Así las claves de la LRU no dependen del prefijo ni de las mayúsculas
+        con que llegue cada dirección; una dirección inválida lanza ValueError.
+        """
+        return [
+            (_checksum(token), _checksum(owner), _checksum(spender))
+            for token, owner, spender in triples
+        ]
+    
+    def _cached_allowances(
+        self,
+        triples: List[Tuple[str, str, str]],
+        block: int
+    ) -> Tuple[List[Tuple], List[Optional[int]], List[int]]:
+        """
+        Busca allowances en la LRU para un bloque
+        
+        Args:
+            triples: Tuplas (token, owner, spender) ya normalizadas
+            block: Número de bloque de la lectura
+            
+        Returns:
+            Tupla (claves, allowances con None en los fallos, índices de fallos)
+        """
+        keys = [(token, owner, spender, block) for token, owner, spender in triples]
+        allowances = [self._allowance_cache.get(key) for key in keys]
+        missing = [i for i, allowance in enumerate(allowances) if allowance is None]
+        return keys, allowances, missing
+    
+    def _store_allowances(
+        self,
+        keys: List[Tuple],
+        allowances: List[Optional[int]],
+        missing: List[int],
+        fetched: List[int]
+    ) -> List[int]:
+        """Guarda en la LRU los allowances leídos y devuelve la lista completa"""
+        for i, allowance in zip(missing, fetched):
+            allowances[i] = allowance
+            self._allowance_cache[keys[i]] = allowance
+        
+        while len(self._allowance_cache) > ALLOWANCE_CACHE_SIZE:
+            self._allowance_cache.popitem(last=False)
+        
+        for key in keys:
+            if key in self._allowance_cache:
+                self._allowance_cache.move_to_end(key)
+        
+        return allowances
+    
+    def _allowance_calls(self, triples: List[Tuple[str, str, str]]) -> List[Tuple]:
+        """Construye las llamadas de Multicall3 para allowance(owner, spender)"""
+        return [
+            (_checksum(token_address), True, _encode_allowance(owner, spender))
+            for token_address, owner, spender in triples
+        ]
+    
+    def _decode_allowances(self, results: List[Tuple[bool, bytes]]) -> List[int]:
+        """Decodifica los resultados de aggregate3 como uint256"""
+        # Cada retorno es una única palabra de 32 bytes: int.from_bytes evita
+        # pasar por el decodificador ABI. Un token que revierte o devuelve
+        # datos vacíos cuenta como allowance 0
+        return [
+            int.from_bytes(return_data[:32], 'big')
+            if success and len(return_data) >= 32 else 0
+            for success, return_data in results
+        ]
+
+
+class UniswapClient(_UniswapClientBase):
+    """Cliente para interactuar con Uniswap v4"""
+    
+    def __init__(self, rpc_url: str = None, chain_id: int = 1, rpc_ws_url: str = None):
+        """
+        Inicializa el cliente de Uniswap
+        
+        Args:
+            rpc_url: URL del nodo RPC
+            chain_id: ID de la cadena (1=Mainnet, 11155111=Sepolia, etc.)
+            rpc_ws_url: URL WebSocket del nodo para la suscripción newHeads (opcional)
+        """
+        super().__init__(rpc_url, chain_id, rpc_ws_url)
+        self.session = _make_rpc_session()
+        self.w3 = Web3(_OrjsonHTTPProvider(self.rpc_url, session=self.session))
+    
+    def health_check(self) -> bool:
+        """
+        Comprueba la conexión con el nodo RPC
+        
+        Returns:
+            True si el nodo responde
+        """
+        connected = self.w3.is_connected()
+        if not connected:
+            print(f"Warning: No se puede conectar a {self.rpc_url}")
+        return connected
+    
+    def get_quote(
+        self,
+        token_in: str,
+        token_out: str,
+        amount_in: Union[int, Decimal],
+        decimals_in: int = 18
+    ) -> Dict:
+        """
+        Obtiene una cotización de Uniswap v4
+        
+        Args:
+            token_in: Dirección del token de entrada
+            token_out: Dirección del token de salida
+            amount_in: Cantidad de tokens de entrada
+            decimals_in: Decimales del token de entrada
+            
+        Returns:
+            Dict con información de la cotización
+        """
+        return self.get_quotes_batch([(token_in, token_out, amount_in, decimals_in)])[0]
+    
+    def get_quotes_batch(
+        self,
+        reqs: List[Tuple[str, str, Union[int, Decimal], int]]
+    ) -> List[Dict]:
+        """
+        Obtiene varias cotizaciones de una vez
+        
+        Args:
+            reqs: Lista de tuplas (token_in, token_out, amount_in, decimals_in)
+            
+        Returns:
+            Lista de cotizaciones en el mismo orden
+        """
+        return self._build_quotes(reqs)
+    
+    def prepare_swap_data(
+        self,
+        token_in: str,
+        token_out: str,
+        amount_in: Union[int, Decimal],
+        min_amount_out: Union[int, Decimal],
+        recipient: str,
+        hidden_hash: Optional[str] = None,
+        allow_stale: bool = True
+    ) -> Dict:
+        """
+        Prepara datos para ejecutar un swap
+        
+        Args:
+            token_in: Token de entrada
+            token_out: Token de salida
+            amount_in: Cantidad de entrada
+            min_amount_out: Cantidad mínima de salida
+            recipient: Destinatario
+            hidden_hash: Hash de transacción invisible (opcional)
+            allow_stale: Reutilizar el timestamp cacheado si tiene menos de LATEST_TS_TTL
+            
+        Returns:
+            Dict con datos del swap
+        """
+        return self._swap_data(
+            token_in, token_out, amount_in, min_amount_out, recipient, hidden_hash,
+            self._latest_timestamp(allow_stale)
+        )
+    
+    def _latest_timestamp(self, allow_stale: bool = True) -> int:
+        """
+        Timestamp del último bloque, con caché de LATEST_TS_TTL segundos
+        
+        Args:
+            allow_stale: Si es False se consulta siempre al nodo
+            
+        Returns:
+            Timestamp del bloque
+        """
+        if allow_stale:
+            cached = self._cached_latest_timestamp()
+            if cached is not None:
+                return cached
+        
+        timestamp = self.w3.eth.get_block('latest')['timestamp']
+        self._latest_ts_cache = (time.monotonic(), timestamp)
+        return timestamp
+    
+    def get_pool_info(self, token0: str, token1: str, fee: int = 3000) -> Dict:
+        """
+        Obtiene información de un pool de Uniswap v4
+        
+        Args:
+            token0: Primera dirección de token
+            token1: Segunda dirección de token
+            fee: Fee tier (3000 = 0.3%)
+            
+        Returns:
+            Dict con información del pool
+        """
+        return self.get_pool_infos_batch([(token0, token1, fee)])[0]
+    
+    def get_pool_infos_batch(self, pairs: List[Tuple[str, str, int]]) -> List[Dict]:
+        """
+        Obtiene información de varios pools de una vez
+        
+        Args:
+            pairs: Lista de tuplas (token0, token1, fee)
+            
+        Returns:
+            Lista de Dicts con información de cada pool, en el mismo orden
+        """
+        metas = [self._get_pool_meta(token0, token1, fee) for token0, token1, fee in pairs]
+        
+        if self.pool_manager_address and metas:
+            # slot0 y liquidez de todos los pools en un único eth_call
+            states = self._decode_pool_states(
+                self._aggregate3(self._pool_state_calls(metas), 'latest')
+            )
+        else:
+            states = [self._simulated_pool_state()] * len(metas)
         
-        return abis.get(contract_name, [])
+        return [dict(meta, **state) for meta, state in zip(metas, states)]
     
     def check_allowance(
         self,
@@ -205,32 +746,291 @@ class UniswapClient:
         Returns:
             Allowance actual
         """
-        # ABI mínimo de ERC20 para allowance
-        erc20_abi = [
-            {
-                "constant": True,
-                "inputs": [
-                    {"name": "owner", "type": "address"},
-                    {"name": "spender", "type": "address"}
-                ],
-                "name": "allowance",
-                "outputs": [{"name": "", "type": "uint256"}],
-                "type": "function"
-            }
-        ]
+        return self.check_allowances_batch([(token_address, owner, spender)])[0]
+    
+    def check_allowances_batch(
+        self,
+        triples: List[Tuple[str, str, str]]
+    ) -> List[int]:
+        """
+        Verifica varios allowances en un único eth_call usando Multicall3
+        
+        Args:
+            triples: Lista de tuplas (token, owner, spender)
+            
+        Returns:
+            Lista de allowances en el mismo orden (0 si la llamada falla);
+            ValueError si alguna dirección no es válida
+        """
+        if not triples:
+            return []
+        
+        # Fuera del try: una dirección inválida es un error del llamador, no un 0
+        triples = self._normalize_triples(triples)
         
         try:
-            token_contract = self.w3.eth.contract(
-                address=Web3.to_checksum_address(token_address),
-                abi=erc20_abi
+            block = self._block_number()
+            keys, allowances, missing = self._cached_allowances(triples, block)
+            
+            if len(missing) == 1:
+                # Una sola lectura: llamada directa al token, sin pasar por Multicall3
+                token, owner, spender = triples[missing[0]]
+                try:
+                    result = self._eth_call(token, _encode_allowance(owner, spender), block)
+                    fetched = self._decode_allowances([(True, result)])
+                except ContractLogicError:
+                    # Igual que allowFailure en aggregate3: el revert vale 0 solo
+                    # para esta entrada, sin tirar los aciertos de la caché
+                    fetched = [0]
+            elif missing:
+                fetched = self._decode_allowances(
+                    self._aggregate3(self._allowance_calls([triples[i] for i in missing]), block)
+                )
+            else:
+                fetched = []
+            
+            return self._store_allowances(keys, allowances, missing, fetched)
+        except Exception as e:
+            print(f"Error checking allowance: {e}")
+            return [0] * len(triples)
+    
+    def _aggregate3(self, calls: List[Tuple], block) -> List[Tuple[bool, bytes]]:
+        """
+        Ejecuta Multicall3.aggregate3 en un único eth_call
+        
+        Args:
+            calls: Lista de tuplas (target, allowFailure, callData)
+            block: Número de bloque o etiqueta
+            
+        Returns:
+            Lista de tuplas (success, returnData) en el mismo orden
+        """
+        result = self._eth_call(MULTICALL3_ADDRESS, self._aggregate3_calldata(calls), block)
+        return self._decode_aggregate3(result)
+    
+    def _eth_call(self, to: str, data: bytes, block) -> bytes:
+        """
+        eth_call de solo lectura por el camino más corto disponible
+        
+        Con un endpoint HTTP se usa _raw_eth_call; en otro caso, web3.
+        """
+        if self.rpc_url.startswith(("http://", "https://")):
+            return self._raw_eth_call(to, data, block)
+        return bytes(self.w3.eth.call({'to': _checksum(to), 'data': '0x' + data.hex()}, block))
+    
+    def _raw_eth_call(self, to: str, data: bytes, block='latest') -> bytes:
+        """
+        eth_call enviado directamente por la sesión HTTP del cliente
+        
+        Se salta la pila de middlewares de web3 (validación, formateadores,
+        AttributeDict), que en lecturas de alta frecuencia cuesta más que la
+        propia llamada.
+        
+        Args:
+            to: Dirección del contrato
+            data: Calldata
+            block: Número de bloque o etiqueta ('latest')
+            
+        Returns:
+            Datos devueltos por el contrato
+        """
+        payload = orjson.dumps({
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "eth_call",
+            "params": [
+                {"to": to, "data": "0x" + data.hex()},
+                hex(block) if isinstance(block, int) else block
+            ]
+        })
+        response = self.session.post(
+            self.rpc_url,
+            data=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=10
+        )
+        response.raise_for_status()
+        
+        body = orjson.loads(response.content)
+        if "error" in body:
+            error = body["error"]
+            # Como web3: un revert del contrato es ContractLogicError, el resto ValueError
+            if "revert" in str(error.get("message", "")):
+                raise ContractLogicError(error["message"])
+            raise ValueError(error)
+        return bytes.fromhex(_strip0x(body["result"]))
+    
+    def _block_number(self) -> int:
+        """Número del bloque actual, con caché de BLOCK_NUMBER_TTL segundos"""
+        block = self._cached_block_number()
+        if block is None:
+            block = self.w3.eth.block_number
+            self._block_number_cache = (time.monotonic(), block)
+        return block
+
+
+class AsyncUniswapClient(_UniswapClientBase):
+    """
+    Variante asíncrona del cliente sobre AsyncWeb3
+    
+    Las lecturas RPC independientes se lanzan en paralelo con asyncio.gather,
+    de modo que el coste es el de la llamada más lenta y no la suma de todas.
+    Los métodos que tocan el nodo son corrutinas; UniswapClient sigue siendo
+    la fachada síncrona para el código existente.
+    """
+    
+    def __init__(self, rpc_url: str = None, chain_id: int = 1, rpc_ws_url: str = None):
+        """
+        Inicializa el cliente asíncrono de Uniswap
+        
+        Args:
+            rpc_url: URL del nodo RPC
+            chain_id: ID de la cadena (1=Mainnet, 11155111=Sepolia, etc.)
+            rpc_ws_url: URL WebSocket del nodo para la suscripción newHeads (opcional)
+        """
+        super().__init__(rpc_url, chain_id, rpc_ws_url)
+        self.w3 = AsyncWeb3(_OrjsonAsyncHTTPProvider(self.rpc_url))
+    
+    async def health_check(self) -> bool:
+        """
+        Comprueba la conexión con el nodo RPC
+        
+        Returns:
+            True si el nodo responde
+        """
+        connected = await self.w3.is_connected()
+        if not connected:
+            print(f"Warning: No se puede conectar a {self.rpc_url}")
+        return connected
+    
+    async def get_quote(
+        self,
+        token_in: str,
+        token_out: str,
+        amount_in: Union[int, Decimal],
+        decimals_in: int = 18
+    ) -> Dict:
+        """Obtiene una cotización de Uniswap v4 (ver UniswapClient.get_quote)"""
+        return (await self.get_quotes_batch([(token_in, token_out, amount_in, decimals_in)]))[0]
+    
+    async def get_quotes_batch(
+        self,
+        reqs: List[Tuple[str, str, Union[int, Decimal], int]]
+    ) -> List[Dict]:
+        """Obtiene varias cotizaciones de una vez (ver UniswapClient.get_quotes_batch)"""
+        # La cotización todavía es simulada y no toca el nodo
+        return self._build_quotes(reqs)
+    
+    async def prepare_swap_data(
+        self,
+        token_in: str,
+        token_out: str,
+        amount_in: Union[int, Decimal],
+        min_amount_out: Union[int, Decimal],
+        recipient: str,
+        hidden_hash: Optional[str] = None,
+        decimals_in: int = 18,
+        allow_stale: bool = True
+    ) -> Dict:
+        """
+        Prepara datos para ejecutar un swap, pidiendo bloque y cotización a la vez
+        
+        Args:
+            token_in: Token de entrada
+            token_out: Token de salida
+            amount_in: Cantidad de entrada
+            min_amount_out: Cantidad mínima de salida
+            recipient: Destinatario
+            hidden_hash: Hash de transacción invisible (opcional)
+            decimals_in: Decimales del token de entrada
+            allow_stale: Reutilizar el timestamp cacheado si tiene menos de LATEST_TS_TTL
+            
+        Returns:
+            Dict con datos del swap y la cotización usada
+        """
+        timestamp = self._cached_latest_timestamp() if allow_stale else None
+        if timestamp is None:
+            block_task = asyncio.create_task(self.w3.eth.get_block('latest'))
+            quote_task = asyncio.create_task(
+                self.get_quote(token_in, token_out, amount_in, decimals_in)
             )
+            block, quote = await asyncio.gather(block_task, quote_task)
+            timestamp = block['timestamp']
+            self._latest_ts_cache = (time.monotonic(), timestamp)
+        else:
+            quote = await self.get_quote(token_in, token_out, amount_in, decimals_in)
+        
+        swap_data = self._swap_data(
+            token_in, token_out, amount_in, min_amount_out, recipient, hidden_hash, timestamp
+        )
+        swap_data["quote"] = quote
+        return swap_data
+    
+    async def get_pool_info(self, token0: str, token1: str, fee: int = 3000) -> Dict:
+        """Obtiene información de un pool de Uniswap v4 (ver UniswapClient.get_pool_info)"""
+        return (await self.get_pool_infos_batch([(token0, token1, fee)]))[0]
+    
+    async def get_pool_infos_batch(self, pairs: List[Tuple[str, str, int]]) -> List[Dict]:
+        """Obtiene información de varios pools en un único eth_call"""
+        metas = [self._get_pool_meta(token0, token1, fee) for token0, token1, fee in pairs]
+        
+        if self.pool_manager_address and metas:
+            states = self._decode_pool_states(
+                await self._aggregate3(self._pool_state_calls(metas), 'latest')
+            )
+        else:
+            states = [self._simulated_pool_state()] * len(metas)
+        
+        return [dict(meta, **state) for meta, state in zip(metas, states)]
+    
+    async def check_allowance(
+        self,
+        token_address: str,
+        owner: str,
+        spender: str
+    ) -> int:
+        """Verifica el allowance de un token (ver UniswapClient.check_allowance)"""
+        return (await self.check_allowances_batch([(token_address, owner, spender)]))[0]
+    
+    async def check_allowances_batch(
+        self,
+        triples: List[Tuple[str, str, str]]
+    ) -> List[int]:
+        """Verifica varios allowances en un único eth_call usando Multicall3"""
+        if not triples:
+            return []
+        
+        # Fuera del try: una dirección inválida es un error del llamador, no un 0
+        triples = self._normalize_triples(triples)
+        
+        try:
+            block = await self._block_number()
+            keys, allowances, missing = self._cached_allowances(triples, block)
             
-            allowance = token_contract.functions.allowance(
-                Web3.to_checksum_address(owner),
-                Web3.to_checksum_address(spender)
-            ).call()
+            if missing:
+                fetched = self._decode_allowances(
+                    await self._aggregate3(self._allowance_calls([triples[i] for i in missing]), block)
+                )
+            else:
+                fetched = []
             
-            return allowance
+            return self._store_allowances(keys, allowances, missing, fetched)
         except Exception as e:
             print(f"Error checking allowance: {e}")
-            return 0
+            return [0] * len(triples)
+    
+    async def _aggregate3(self, calls: List[Tuple], block) -> List[Tuple[bool, bytes]]:
+        """Ejecuta Multicall3.aggregate3 en un único eth_call"""
+        result = await self.w3.eth.call(
+            {'to': MULTICALL3_ADDRESS, 'data': '0x' + self._aggregate3_calldata(calls).hex()},
+            block
+        )
+        return self._decode_aggregate3(bytes(result))
+    
+    async def _block_number(self) -> int:
+        """Número del bloque actual, con caché de BLOCK_NUMBER_TTL segundos"""
+        block = self._cached_block_number()
+        if block is None:
+            block = await self.w3.eth.block_number
+            self._block_number_cache = (time.monotonic(), block)
+        return block